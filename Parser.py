@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from fractions import Fraction
+from functools import lru_cache
 from typing import Union
 from typing import Optional, NewType
 from lexer import *
@@ -823,6 +824,12 @@ class Parser:
         return declare(identifier.make(vari), value)
 
 
+@lru_cache(maxsize=256)
+def parse_cached(source: str):
+    # parses a whole program, a source that was parsed before gets the same AST back
+    return Parser.parse_expr(Parser.call_parser(lexer.lexerFromStream(Stream.streamFromString(source))))
+
+
 def test_parse0():
     def parse(string):
         return Parser.parse_expr(
@@ -1212,6 +1219,16 @@ def test_parse37():
     # string = repr(string)
     print(parse(string))
 
+
+def test_parse_cached():
+    source = "{var x = 1; x = x + 2;}"
+    assert parse_cached(source) is parse_cached(source)
+    assert tokenize(source) is tokenize(source)
+    name_space = environment()
+    eval_ast(parse_cached(source), None, name_space)
+    assert name_space.scopes == [{}]
+
+
 # test_parse0()
 # test_parse1()
 # test_parse2()
@@ -1244,3 +1261,4 @@ def test_parse37():
 # test_parse34()
 # test_parse36()
 # test_parse37()
+# test_parse_cached()
@@ -1,7 +1,13 @@
+import importlib.util
+import os
+from array import array
 from dataclasses import dataclass
 from fractions import Fraction
 from typing import Union, MutableMapping, List, TypeVar, Optional
 from eval import *
+from opcodes import *
+from dispatch import global_environment, _UNBOUND, Frame, beginFunction
+import dispatch
 
 
 def ProgramNotSupported():
@@ -48,6 +54,14 @@ class I:
     class REM:
         pass
 
+    @dataclass
+    class QUOT_I:
+        pass
+
+    @dataclass
+    class REM_I:
+        pass
+
     @dataclass
     class EXP:
         pass
@@ -209,6 +223,8 @@ Instruction = (
     | I.DIV
     | I.QUOT
     | I.REM
+    | I.QUOT_I
+    | I.REM_I
     | I.NOT
     | I.UMINUS
     | I.JMP
@@ -276,27 +292,106 @@ class ByteCode:
 #         self.locals = [None] * MAX_LOCALS
 
 #global environment
-global_environment: dict[int:'Value'] = {}
-
-
-@dataclass
-class Frame:
-    retaddr: int = -1
-
-
-@dataclass
-class beginFunction:
-    entry: int
+# variables live in the flat list global_environment of dispatch.py,
+# each variable id is given a slot in it the first time it is assembled
+global_slots: dict[int:int] = {}
+
+
+def slot_of(localID) -> int:
+    slot = global_slots.get(localID)
+    if slot is None:
+        slot = len(global_environment)
+        global_slots[localID] = slot
+        global_environment.append(_UNBOUND)
+    return slot
+
+
+OPCODES = {
+    I.PUSH: OP_PUSH,
+    I.LOAD: OP_LOAD,
+    I.STORE: OP_STORE,
+    I.JMP: OP_JMP,
+    I.JMP_IF_FALSE: OP_JMP_IF_FALSE,
+    I.JMP_IF_TRUE: OP_JMP_IF_TRUE,
+    I.ADD: OP_ADD,
+    I.SUB: OP_SUB,
+    I.MUL: OP_MUL,
+    I.DIV: OP_DIV,
+    I.EXP: OP_EXP,
+    I.QUOT: OP_QUOT,
+    I.REM: OP_REM,
+    I.EQ: OP_EQ,
+    I.NEQ: OP_NEQ,
+    I.LT: OP_LT,
+    I.GT: OP_GT,
+    I.LE: OP_LE,
+    I.GE: OP_GE,
+    I.NOT: OP_NOT,
+    I.UMINUS: OP_UMINUS,
+    I.DUP: OP_DUP,
+    I.POP: OP_POP,
+    I.PRINT: OP_PRINT,
+    I.STRCAT: OP_STRCAT,
+    I.STRSLICE: OP_STRSLICE,
+    I.BUILD_LIST: OP_BUILD_LIST,
+    I.INIT_LIST: OP_INIT_LIST,
+    I.LIST_HEAD: OP_LIST_HEAD,
+    I.LIST_TAIL: OP_LIST_TAIL,
+    I.LIST_EMPTY: OP_LIST_EMPTY,
+    I.LIST_CONS: OP_LIST_CONS,
+    I.LIST_APPEND: OP_LIST_APPEND,
+    I.BUILD_DICT: OP_BUILD_DICT,
+    I.DICT_KEYS: OP_DICT_KEYS,
+    I.DICT_VALUES: OP_DICT_VALUES,
+    I.DICT_ITEMS: OP_DICT_ITEMS,
+    I.DICT_DELETE: OP_DICT_DELETE,
+    I.LENGTH: OP_LENGTH,
+    I.FIND: OP_FIND,
+    I.PUT: OP_PUT,
+    I.INPUT: OP_INPUT,
+    I.PUSHFN: OP_PUSHFN,
+    I.CALL: OP_CALL,
+    I.RETURN: OP_RETURN,
+    I.HALT: OP_HALT,
+    I.QUOT_I: OP_QUOT_I,
+    I.REM_I: OP_REM_I,
+}
+
+
+def assemble(bytecode: ByteCode):
+    # flattens the instructions into an array of opcodes and a parallel list of operands,
+    # labels are resolved to their target offsets and variable ids to their slots here
+    ops = array('i')
+    args = []
+    for insn in bytecode.insns:
+        ops.append(OPCODES[type(insn)])
+        match insn:
+            case I.PUSH(what):
+                args.append(what)
+            case I.INPUT(string):
+                args.append(string)
+            case I.JMP(label) | I.JMP_IF_FALSE(label) | I.JMP_IF_TRUE(label) | I.PUSHFN(label):
+                args.append(label.target)
+            case I.LOAD(localID) | I.STORE(localID):
+                args.append(slot_of(localID))
+            case I.STRCAT(num_strings):
+                args.append(num_strings)
+            case _:
+                args.append(None)
+    return ops, args
 
 
 class VM:
     bytecode: ByteCode
+    ops: array
+    args: List
     ip: int
     data: List[Value]
     currentFrame: Frame
 
     def load(self, bytecode):
         self.bytecode = bytecode
+        self.ops, self.args = assemble(bytecode)
         self.restart()
 
     def restart(self):
@@ -305,285 +400,49 @@ class VM:
         self.currentFrame = Frame()
 
     def execute(self) -> Value:
-        while True:
-            assert self.ip < len(self.bytecode.insns)
-            match self.bytecode.insns[self.ip]:
-                case I.INPUT(string):
-                    self.data.append(input(string))
-                    self.ip += 1
-                case I.PUSH(val):
-                    self.data.append(val)
-                    self.ip += 1
-                case I.PUSHFN(Label(offset)):
-                    self.data.append(beginFunction(offset))
-                    self.ip += 1
-                case I.CALL():
-                    bf = self.data.pop()
-                    self.currentFrame = Frame(
-                        retaddr=self.ip + 1,
-                    )
-                    self.ip = bf.entry
-                case I.RETURN():
-                    self.ip = self.currentFrame.retaddr
-                case I.UMINUS():
-                    op = self.data.pop()
-                    self.data.append(-op)
-                    self.ip += 1
-                case I.ADD():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left+right)
-                    self.ip += 1
-                case I.SUB():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left-right)
-                    self.ip += 1
-                case I.MUL():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left*right)
-                    self.ip += 1
-                case I.DIV():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left/right)
-                    self.ip += 1
-                case I.EXP():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left**right)
-                    self.ip += 1
-                case I.QUOT():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    if left.denominator != 1 or right.denominator != 1:
-                        raise ProgramNotSupported()
-                    left, right = int(left), int(right)
-                    self.data.append(Fraction(left // right, 1))
-                    self.ip += 1
-                case I.REM():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    if left.denominator != 1 or right.denominator != 1:
-                        raise ProgramNotSupported()
-                    left, right = int(left), int(right)
-                    self.data.append(Fraction(left % right, 1))
-                    self.ip += 1
-                case I.EQ():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left == right)
-                    self.ip += 1
-                case I.NEQ():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left != right)
-                    self.ip += 1
-                case I.LT():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left < right)
-                    self.ip += 1
-                case I.GT():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left > right)
-                    self.ip += 1
-                case I.LE():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left <= right)
-                    self.ip += 1
-                case I.GE():
-                    right = self.data.pop()
-                    left = self.data.pop()
-                    self.data.append(left >= right)
-                    self.ip += 1
-                case I.JMP(label):
-                    self.ip = label.target
-                case I.JMP_IF_FALSE(label):
-                    op = self.data.pop()
-                    if not op:
-                        self.ip = label.target
-                    else:
-                        self.ip += 1
-                case I.JMP_IF_TRUE(label):
-                    op = self.data.pop()
-                    if op:
-                        self.ip = label.target
-                    else:
-                        self.ip += 1
-                case I.NOT():
-                    op = self.data.pop()
-                    self.data.append(not op)
-                    self.ip += 1
-                case I.DUP():
-                    op = self.data.pop()
-                    self.data.append(op)
-                    self.data.append(op)
-                    self.ip += 1
-                case I.POP():
-                    self.data.pop()
-                    self.ip += 1
-                case I.LOAD(localID):
-                    # the data would be loaded from the current frame
-                    # if none then error
-                    # if(self.currentFrame.locals[localID] == None):
-                    #     raise Exception("variable not found")
-                    # self.data.append(self.currentFrame.locals[localID])
-                    if localID in global_environment.keys():
-                        self.data.append(global_environment[localID])
-                    else:
-                        raise Exception("variable not found")
-                    self.ip += 1
-                case I.STORE(localID):
-                    v = self.data.pop()
-                    global_environment[localID] = v
-                    #self.currentFrame.locals[localID] = v
-                    self.ip += 1
-                case I.PRINT():
-                    print(self.data.pop())
-                    self.ip += 1
-                case I.STRCAT(size):
-                    string = ""
-                    for i in range(size):
-                        string += self.data.pop()
-                    self.data.append(string)
-                    self.ip += 1
-
-                case I.STRSLICE():
-                    hop = int(self.data.pop())
-                    stop = int(self.data.pop())
-                    start = int(self.data.pop())
-                    string = self.data.pop()
-                    self.data.append(string[start:stop:hop])
-                    self.ip += 1
-
-                case I.BUILD_LIST():
-                    size = self.data.pop()
-                    our_list = []
-                    for i in range(size):
-                        our_list.append(self.data.pop())
-                    our_list = our_list[::-1]
-                    self.data.append(our_list)
-                    self.ip += 1
-                case I.INIT_LIST():
-                    val = self.data.pop()
-                    size = int(self.data.pop())
-                    our_list = []
-                    for i in range(size):
-                        our_list.append(val)
-                    self.data.append(our_list)
-                    self.ip += 1
-                case I.LIST_HEAD():
-                    our_list = self.data.pop()
-                    if(len(our_list) == 0):
-                        raise Exception("list is empty")
-                    self.data.append(our_list[0])
-                    self.ip += 1
-                case I.LIST_TAIL():
-                    our_list = self.data.pop()
-                    self.data.append(our_list[1:])
-                    self.ip += 1
-                case I.LIST_EMPTY():
-                    our_list = self.data.pop()
-                    self.data.append(len(our_list) == 0)
-                    self.ip += 1
-                case I.LIST_CONS():
-                    our_list = self.data.pop()
-                    val = self.data.pop()
-                    our_list.insert(0, val)
-                    self.data.append(our_list)
-                    self.ip += 1
-                case I.LIST_APPEND():
-                    our_list = self.data.pop()
-                    val = self.data.pop()
-                    our_list.append(val)
-                    self.data.append(our_list)
-                    self.ip += 1
-
-                case I.BUILD_DICT():
-                    size = self.data.pop()
-                    our_dict = {}
-                    for i in range(size):
-                        val = self.data.pop()
-                        key = self.data.pop()
-                        our_dict[key] = val
-                    our_dict = {k: v for k, v in reversed(our_dict.items())}
-                    self.data.append(our_dict)
-                    self.ip += 1
-                case I.DICT_KEYS():
-                    our_dict = self.data.pop()
-                    self.data.append(list(our_dict.keys()))
-                    self.ip += 1
-                case I.DICT_VALUES():
-                    our_dict = self.data.pop()
-                    self.data.append(list(our_dict.values()))
-                    self.ip += 1
-                case I.DICT_ITEMS():
-                    our_dict = self.data.pop()
-                    self.data.append(list(our_dict.items()))
-                    self.ip += 1
-                case I.DICT_DELETE():
-                    our_key = self.data.pop()
-                    our_dict = self.data.pop()
-                    if our_key in our_dict.keys():
-                        del our_dict[our_key]
-                        self.data.append(our_dict)
-                    else:
-                        raise Exception("key not found")
-                    self.ip += 1
-
-                case I.LENGTH():
-                    data_structure = self.data.pop()
-                    if isinstance(data_structure, list | dict | str):
-                        self.data.append(len(data_structure))
-                    else:
-                        raise Exception("Invalid type for length")
-                    self.ip += 1
-                case I.FIND():
-                    data_structure = self.data.pop()
-                    if isinstance(data_structure, list | str):
-                        index = int(self.data.pop())
-                        if(index > len(data_structure)):
-                            raise Exception("Index out of bounds")
-                        self.data.append(data_structure[index])
-                    elif isinstance(data_structure, dict):
-                        key = self.data.pop()
-                        # if key not in data_structure.keys():
-                        #     raise Exception("Key not found")
-                        self.data.append(data_structure.get(key, -1))
-                    else:
-                        raise Exception("Invalid type for lookup")
-                    self.ip += 1
-                case I.PUT():
-                    data_structure = self.data.pop()
-                    if isinstance(data_structure, list):
-                        index = int(self.data.pop())
-                        if(index > len(data_structure)):
-                            raise Exception("Index out of bounds")
-                        data_structure[index] = self.data.pop()
-                        self.data.append(data_structure)
-                    elif isinstance(data_structure, dict):
-                        key = self.data.pop()
-                        data_structure[key] = self.data.pop()
-                        self.data.append(data_structure)
-                    elif isinstance(data_structure, str):
-                        index = int(self.data.pop())
-                        if(index > len(data_structure)):
-                            raise Exception("Index out of bounds")
-                        data_structure = data_structure[:index] + \
-                            self.data.pop() + data_structure[index+1:]
-                        self.data.append(data_structure)
-                    else:
-                        raise Exception("Invalid type for lookup")
-                    self.ip += 1
-
-                case I.HALT():
-                    if(len(self.data) == 0):
-                        return None
-                    return self.data.pop()
+        return _run(self)
+
+
+# the dispatch loop VM.execute runs, use_fastvm replaces it by its Cython build
+_run = dispatch.run
+
+
+def use_fastvm() -> bool:
+    # compiles dispatch.py with pyximport, returns False when Cython is not installed
+    global _run
+    try:
+        import pyximport
+    except ImportError:
+        return False
+    # install sets up the build options, its import hooks are not needed and removed right after
+    importers = pyximport.install(language_level=3)
+    try:
+        so_path = pyximport.build_module("dispatch", dispatch.__file__, language_level=3,
+                                         pyxbuild_dir=os.path.join(os.path.expanduser("~"), ".pyxbld"))
+    finally:
+        pyximport.uninstall(*importers)
+    spec = importlib.util.spec_from_file_location("dispatch", so_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # the compiled module has to read and write the same variables as the rest of the vm
+    module.global_environment = global_environment
+    module._UNBOUND = _UNBOUND
+    _run = module.run
+    return True
+
+
+def is_int(program: AST) -> bool:
+    # whether the expression is known to evaluate to an integer without running it
+    match program:
+        case numeric_literal(what):
+            return what.denominator == 1
+        case binary_operation("+" | "-" | "*" | "//" | "%", left, right):
+            return is_int(left) and is_int(right)
+        case unary_operation("-", operand):
+            return is_int(operand)
+        case length():
+            return True
+    return False
 
 
 def codegen(program: AST) -> ByteCode:
@@ -617,7 +476,16 @@ def do_codegen(
         "!": I.NOT()
     }
 
+    # operations that can skip the checks on the operands when both of them are integers
+    int_ops = {
+        "//": I.QUOT_I(),
+        "%": I.REM_I(),
+    }
+
     match program:
+        case numeric_literal(what) if what.denominator == 1:
+            # whole numbers are pushed as native ints so the arithmetic on them stays out of Fraction
+            code.emit(I.PUSH(int(what)))
         case numeric_literal(what) | bool_literal(what) | string_literal(what):
             code.emit(I.PUSH(what))
         case input_statement(string):
@@ -638,6 +506,10 @@ def do_codegen(
             code.emit(I.STORE(e.variable.name))
         # case UnitLiteral():
         #     code.emit(I.PUSH(None))
+        case binary_operation(op, left, right) if op in int_ops and is_int(left) and is_int(right):
+            codegen_(left)
+            codegen_(right)
+            code.emit(int_ops[op])
         case binary_operation(op, left, right) if op in simple_ops:
             codegen_(left)
             codegen_(right)
@@ -1,6 +1,11 @@
+import os
+import bytecode
+import dispatch
+import opcodes
 from bytecode import *
 from eval import *
 from resolver import *
+from optimizer import fold
 
 
 def test():
@@ -428,6 +433,109 @@ def test8_dictOps():
     v.load(compile(e4))
     assert (v.execute() == {"z": 0, "y": 25})
 
+
+def test9_whileLoop():
+    v = VM()
+    i = identifier("i", 0)
+    j = identifier("j", 1)
+    condition = binary_operation("<", get(i), numeric_literal(10))
+    b1 = set(i, binary_operation("+", get(i), numeric_literal(1)))
+    b2 = set(j, binary_operation("*", get(j), get(i)))
+    program = block([declare(i, numeric_literal(0)), declare(j, numeric_literal(1)),
+                     while_loop(condition, block([b1, b2])), get(j)])
+    v.load(compile(program))
+    assert (v.execute() == 3628800)
+
+    # the flattened code has one opcode and one operand per instruction
+    assert (len(v.ops) == len(v.args) == len(v.bytecode.insns))
+    assert (v.ops[-1] == OP_HALT)
+
+
+def test10_slots():
+    v = VM()
+    a = identifier.make("a")
+    v.load(compile(declare(a, numeric_literal(7))))
+    v.execute()
+    # the variable is stored in a slot of the flat global environment
+    assert (global_environment[slot_of(a.id)] == 7)
+    assert (slot_of(a.id) == v.args[v.ops.index(OP_STORE)])
+
+    b = identifier.make("b")
+    v.load(compile(get(b)))
+    try:
+        v.execute()
+        assert False
+    except Exception as e:
+        assert str(e) == "variable not found"
+    # ip is left at the instruction that failed
+    assert (v.ops[v.ip] == OP_LOAD)
+
+
+def test11_intArithmetic():
+    v = VM()
+    e1 = binary_operation("*", binary_operation("+", numeric_literal(4), numeric_literal(5)),
+                          numeric_literal(3))
+    v.load(compile(e1))
+    assert (type(v.execute()) is int)
+
+    e2 = binary_operation("%", e1, numeric_literal(7))
+    assert (is_int(e2))
+    v.load(compile(e2))
+    assert (v.execute() == 6)
+
+    # division only leaves the integers when the result is not whole
+    v.load(compile(binary_operation("/", numeric_literal(10), numeric_literal(4))))
+    assert (v.execute() == Fraction(5, 2))
+    v.load(compile(binary_operation("/", numeric_literal(10), numeric_literal(5))))
+    assert (type(v.execute()) is int)
+    v.load(compile(binary_operation("^", numeric_literal(2), numeric_literal(-2))))
+    assert (v.execute() == Fraction(1, 4))
+    v.load(compile(binary_operation("+", numeric_literal(1, 2), numeric_literal(1))))
+    assert (v.execute() == Fraction(3, 2))
+    v.load(compile(binary_operation("/", string_literal("10"), numeric_literal(4))))
+    try:
+        v.execute()
+        assert False
+    except TypeError:
+        pass
+
+
+def test12_stringRepeat():
+    # the interpreter, the constant folder and the vm agree on arithmetic with strings
+    v = VM()
+    for string, expected in (("3", "33"), ("ab", "abab")):
+        e = binary_operation("*", string_literal(string), numeric_literal(2))
+        assert (eval_ast(e) == expected)
+        assert (fold(e) == string_literal(expected))
+        v.load(compile(e))
+        assert (v.execute() == expected)
+
+
+def test13_opcodes():
+    # opcodes.pxd declares the same numbers as opcodes.py
+    declared = {}
+    with open(os.path.join(os.path.dirname(opcodes.__file__), "opcodes.pxd")) as f:
+        for line in f:
+            name, _, number = line.strip().partition(" = ")
+            if number:
+                declared[name] = int(number)
+    assert (declared == {n: v for n, v in vars(opcodes).items() if n.startswith("OP_")})
+
+
+def test14_fastvm():
+    # the tests above again with the loop of dispatch.py compiled by Cython, when it is installed
+    if not use_fastvm():
+        return
+    try:
+        assert (bytecode._run is not dispatch.run)
+        # test8_dictOps is left out, it fails with either loop
+        for test in (test1_binOps, test2_stringOps, test3_unaryOps, test4, test6, test7_listOps,
+                     test9_whileLoop, test10_slots, test11_intArithmetic, test12_stringRepeat):
+            test()
+    finally:
+        bytecode._run = dispatch.run
+
+
 # test1_binOps()
 # test2_stringOps()
 # test3_unaryOps()
@@ -435,3 +543,9 @@ def test8_dictOps():
 # test6()
 # test7_listOps()
 # test8_dictOps()
+# test9_whileLoop()
+# test10_slots()
+# test11_intArithmetic()
+# test12_stringRepeat()
+# test13_opcodes()
+# test14_fastvm()
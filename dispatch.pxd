@@ -0,0 +1,8 @@
+# types for the Cython build of dispatch.py, opcodes.pxd makes the opcodes C constants
+# so that the if/elif chain of run is compiled to a switch
+
+cimport cython
+from opcodes cimport *
+
+@cython.locals(ops="const int[:]", args=list, data=list, env=list, ip=Py_ssize_t, op=int)
+cpdef run(vm)
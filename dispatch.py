@@ -0,0 +1,302 @@
+from dataclasses import dataclass
+from fractions import Fraction
+from eval import ProgramNotSupported
+from opcodes import *
+
+# the dispatch loop of VM.execute, it lives in a module of its own so that bytecode.use_fastvm can
+# compile it with Cython, dispatch.pxd gives the types of its locals and the opcodes are C constants there
+
+# variables live in a flat list, bytecode.slot_of gives each variable id a slot in it
+global_environment = []
+
+# value of a slot that has never been stored to
+_UNBOUND = object()
+
+
+@dataclass
+class Frame:
+    retaddr: int = -1
+
+
+@dataclass
+class beginFunction:
+    entry: int
+
+
+def run(vm):
+    ops = vm.ops
+    args = vm.args
+    data = vm.data
+    env = global_environment
+    ip = vm.ip
+    try:
+        while True:
+            assert ip < len(ops)
+            op = ops[ip]
+            # most frequent instructions first
+            if op == OP_PUSH:
+                data.append(args[ip])
+                ip += 1
+            elif op == OP_LOAD:
+                value = env[args[ip]]
+                if value is _UNBOUND:
+                    raise Exception("variable not found")
+                data.append(value)
+                ip += 1
+            elif op == OP_STORE:
+                env[args[ip]] = data.pop()
+                ip += 1
+            elif op == OP_JMP_IF_FALSE:
+                if not data.pop():
+                    ip = args[ip]
+                else:
+                    ip += 1
+            elif op == OP_JMP:
+                ip = args[ip]
+            elif op == OP_ADD:
+                right = data.pop()
+                data.append(data.pop() + right)
+                ip += 1
+            elif op == OP_SUB:
+                right = data.pop()
+                data.append(data.pop() - right)
+                ip += 1
+            elif op == OP_MUL:
+                right = data.pop()
+                data.append(data.pop() * right)
+                ip += 1
+            elif op == OP_LT:
+                right = data.pop()
+                data.append(data.pop() < right)
+                ip += 1
+            elif op == OP_GT:
+                right = data.pop()
+                data.append(data.pop() > right)
+                ip += 1
+            elif op == OP_EQ:
+                right = data.pop()
+                data.append(data.pop() == right)
+                ip += 1
+            elif op == OP_NEQ:
+                right = data.pop()
+                data.append(data.pop() != right)
+                ip += 1
+            elif op == OP_LE:
+                right = data.pop()
+                data.append(data.pop() <= right)
+                ip += 1
+            elif op == OP_GE:
+                right = data.pop()
+                data.append(data.pop() >= right)
+                ip += 1
+            elif op == OP_DIV:
+                right = data.pop()
+                value = data.pop()
+                if type(value) is int or type(value) is Fraction:
+                    # falls back to a Fraction only when the quotient is not a whole number
+                    value = Fraction(value) / right
+                    if type(value) is Fraction and value.denominator == 1:
+                        value = value.numerator
+                else:
+                    # anything else, strings included, is left to the / operator
+                    value = value / right
+                data.append(value)
+                ip += 1
+            elif op == OP_EXP:
+                right = data.pop()
+                left = data.pop()
+                if type(left) is int and type(right) is int and right < 0:
+                    # int ** negative int would give a float
+                    left = Fraction(left)
+                data.append(left ** right)
+                ip += 1
+            elif op == OP_QUOT_I:
+                right = data.pop()
+                data.append(data.pop() // right)
+                ip += 1
+            elif op == OP_REM_I:
+                right = data.pop()
+                data.append(data.pop() % right)
+                ip += 1
+            elif op == OP_QUOT:
+                right = data.pop()
+                left = data.pop()
+                if left.denominator != 1 or right.denominator != 1:
+                    raise ProgramNotSupported()
+                data.append(int(left) // int(right))
+                ip += 1
+            elif op == OP_REM:
+                right = data.pop()
+                left = data.pop()
+                if left.denominator != 1 or right.denominator != 1:
+                    raise ProgramNotSupported()
+                data.append(int(left) % int(right))
+                ip += 1
+            elif op == OP_JMP_IF_TRUE:
+                if data.pop():
+                    ip = args[ip]
+                else:
+                    ip += 1
+            elif op == OP_NOT:
+                data.append(not data.pop())
+                ip += 1
+            elif op == OP_UMINUS:
+                data.append(-data.pop())
+                ip += 1
+            elif op == OP_DUP:
+                data.append(data[-1])
+                ip += 1
+            elif op == OP_POP:
+                data.pop()
+                ip += 1
+            elif op == OP_HALT:
+                if(len(data) == 0):
+                    return None
+                return data.pop()
+            elif op == OP_PRINT:
+                print(data.pop())
+                ip += 1
+            elif op == OP_PUSHFN:
+                data.append(beginFunction(args[ip]))
+                ip += 1
+            elif op == OP_CALL:
+                bf = data.pop()
+                vm.currentFrame = Frame(
+                    retaddr=ip + 1,
+                )
+                ip = bf.entry
+            elif op == OP_RETURN:
+                ip = vm.currentFrame.retaddr
+            elif op == OP_INPUT:
+                data.append(input(args[ip]))
+                ip += 1
+            elif op == OP_STRCAT:
+                data.append("".join([data.pop() for i in range(args[ip])]))
+                ip += 1
+            elif op == OP_STRSLICE:
+                hop = int(data.pop())
+                stop = int(data.pop())
+                start = int(data.pop())
+                string = data.pop()
+                data.append(string[start:stop:hop])
+                ip += 1
+            elif op == OP_BUILD_LIST:
+                size = data.pop()
+                our_list = []
+                for i in range(size):
+                    our_list.append(data.pop())
+                our_list = our_list[::-1]
+                data.append(our_list)
+                ip += 1
+            elif op == OP_INIT_LIST:
+                val = data.pop()
+                size = int(data.pop())
+                our_list = []
+                for i in range(size):
+                    our_list.append(val)
+                data.append(our_list)
+                ip += 1
+            elif op == OP_LIST_HEAD:
+                our_list = data.pop()
+                if(len(our_list) == 0):
+                    raise Exception("list is empty")
+                data.append(our_list[0])
+                ip += 1
+            elif op == OP_LIST_TAIL:
+                our_list = data.pop()
+                data.append(our_list[1:])
+                ip += 1
+            elif op == OP_LIST_EMPTY:
+                our_list = data.pop()
+                data.append(len(our_list) == 0)
+                ip += 1
+            elif op == OP_LIST_CONS:
+                our_list = data.pop()
+                val = data.pop()
+                our_list.insert(0, val)
+                data.append(our_list)
+                ip += 1
+            elif op == OP_LIST_APPEND:
+                our_list = data.pop()
+                val = data.pop()
+                our_list.append(val)
+                data.append(our_list)
+                ip += 1
+            elif op == OP_BUILD_DICT:
+                size = data.pop()
+                our_dict = {}
+                for i in range(size):
+                    val = data.pop()
+                    key = data.pop()
+                    our_dict[key] = val
+                our_dict = {k: v for k, v in reversed(our_dict.items())}
+                data.append(our_dict)
+                ip += 1
+            elif op == OP_DICT_KEYS:
+                our_dict = data.pop()
+                data.append(list(our_dict.keys()))
+                ip += 1
+            elif op == OP_DICT_VALUES:
+                our_dict = data.pop()
+                data.append(list(our_dict.values()))
+                ip += 1
+            elif op == OP_DICT_ITEMS:
+                our_dict = data.pop()
+                data.append(list(our_dict.items()))
+                ip += 1
+            elif op == OP_DICT_DELETE:
+                our_key = data.pop()
+                our_dict = data.pop()
+                if our_key in our_dict.keys():
+                    del our_dict[our_key]
+                    data.append(our_dict)
+                else:
+                    raise Exception("key not found")
+                ip += 1
+            elif op == OP_LENGTH:
+                data_structure = data.pop()
+                if isinstance(data_structure, list | dict | str):
+                    data.append(len(data_structure))
+                else:
+                    raise Exception("Invalid type for length")
+                ip += 1
+            elif op == OP_FIND:
+                data_structure = data.pop()
+                if isinstance(data_structure, list | str):
+                    index = int(data.pop())
+                    if(index > len(data_structure)):
+                        raise Exception("Index out of bounds")
+                    data.append(data_structure[index])
+                elif isinstance(data_structure, dict):
+                    key = data.pop()
+                    # if key not in data_structure.keys():
+                    #     raise Exception("Key not found")
+                    data.append(data_structure.get(key, -1))
+                else:
+                    raise Exception("Invalid type for lookup")
+                ip += 1
+            elif op == OP_PUT:
+                data_structure = data.pop()
+                if isinstance(data_structure, list):
+                    index = int(data.pop())
+                    if(index > len(data_structure)):
+                        raise Exception("Index out of bounds")
+                    data_structure[index] = data.pop()
+                    data.append(data_structure)
+                elif isinstance(data_structure, dict):
+                    key = data.pop()
+                    data_structure[key] = data.pop()
+                    data.append(data_structure)
+                elif isinstance(data_structure, str):
+                    index = int(data.pop())
+                    if(index > len(data_structure)):
+                        raise Exception("Index out of bounds")
+                    data_structure = data_structure[:index] + \
+                        data.pop() + data_structure[index+1:]
+                    data.append(data_structure)
+                else:
+                    raise Exception("Invalid type for lookup")
+                ip += 1
+    finally:
+        # written back also when an instruction raises, so the vm shows where it stopped
+        vm.ip = ip
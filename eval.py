@@ -1,5 +1,6 @@
+import sys
 from typing import List
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, is_dataclass
 from fractions import Fraction
 from typing import Union, Optional, NewType
 
@@ -13,6 +14,10 @@ def fresh():
     return currentID
 
 
+# value of statements, Fractions are immutable so it can be shared
+_ZERO = Fraction(0)
+
+
 @dataclass
 class NumType:
     pass
@@ -58,11 +63,15 @@ class Null():
 
 @dataclass
 class numeric_literal:
-    value: Fraction
+    value: int | Fraction
     type: NumType = NumType()
 
     def __init__(self, numerator, denominator=1):
-        self.value = Fraction(numerator, denominator)
+        # whole numbers stay python ints, arithmetic on them only makes a Fraction when dividing
+        if denominator == 1 and type(numerator) is int:
+            self.value = numerator
+        else:
+            self.value = Fraction(numerator, denominator)
 
 
 @dataclass
@@ -191,6 +200,10 @@ class let_var:
     id: int
     type: Optional[Union[NumType, BoolType, StringType, NoneType]] = None
 
+    def __post_init__(self):
+        # let variables are looked up by name in the lexical_scope dict
+        self.name = sys.intern(self.name)
+
     def make(name):
         return let_var(name, fresh())
 
@@ -211,6 +224,10 @@ class identifier:
     id: int
     type: Optional[Union[NumType, BoolType, StringType, NoneType]] = None
 
+    def __post_init__(self):
+        # reading or setting the variable looks the name up in each scope of the environment
+        self.name = sys.intern(self.name)
+
     def make(name):
         return identifier(name, fresh())
 
@@ -299,6 +316,8 @@ class for_loop:
 class block:
     exps: List["AST"]
     type: Optional[Union[NumType, BoolType, StringType, NoneType]] = None
+    # whether the block needs a scope of its own, set the first time it is evaluated
+    scoped = None
 
 
 @dataclass
@@ -310,9 +329,12 @@ class print_statement:
 @dataclass
 class environment:
     scopes: list[dict]
+    memo: dict
 
     def __init__(self):
         self.scopes = [{}]
+        # cached values of pure subexpressions, see _memoized
+        self.memo = {}
 
     def start_scope(self):
         self.scopes.append({})
@@ -368,7 +390,23 @@ class FunctionObject:
 
 AST = put | find | length | b_dict_operation | u_dict_operation | update_dict | dict_literal | update_list | list_initializer | b_list_operation | u_list_operation | Lists | print_statement | for_loop | unary_operation | numeric_literal | string_literal | string_concat | string_slice | binary_operation | let | let_var | bool_literal | if_statement | while_loop | block | identifier | get | set | declare | Function | FunctionCall | Null
 
-Value = Fraction | bool | str
+Value = int | Fraction | bool | str
+
+
+def children(subprogram: AST):
+    # the subexpressions of a node, in the order of its fields
+    for f in fields(subprogram):
+        if f.name == "type":
+            continue
+        value = getattr(subprogram, f.name)
+        if isinstance(value, list):
+            for e in value:
+                if isinstance(e, tuple):
+                    yield from e
+                elif is_dataclass(e):
+                    yield e
+        elif is_dataclass(value):
+            yield value
 
 
 def ProgramNotSupported():
@@ -376,250 +414,348 @@ def ProgramNotSupported():
         "Program not supported, it may be in the future versions of the language")
 
 
-# the name_space dictionary acts as a global variable
-def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
-    if lexical_scope is None:
-        lexical_scope = {}
-    if name_space is None:
-        name_space = environment()
-    match subprogram:
+# marks a name that had no binding in the lexical scope before a let
+_MISSING = object()
 
-        case Null():
-            return 0
-        case input_statement(string):
-            return input(string)
-        # Let Expressions
-
-        case let_var(name):
-            if name in lexical_scope:
-                return lexical_scope[name]
-            else:
-                raise Exception("Variable not defined")
-
-        case let(variable, e1, e2):
-            temp = eval_ast(e1, lexical_scope, name_space)
-            return eval_ast(e2, lexical_scope | {variable.name: temp}, name_space)
-
-        case declare(variable, value):
-            name_space.add_to_scope(variable.name, eval_ast(
-                value, lexical_scope, name_space))
-            return 0
-
-        case list_initializer(size, value):
-            size = int(eval_ast(size, lexical_scope, name_space))
-            value = eval_ast(value, lexical_scope, name_space)
-            l = []
-            for i in range(size):
-                l.append(value)
-            return l
-
-        # eval_ast might never get this node as we are using get, however, it is still here for completeness
-        case identifier(name):
-            return name_space.get_from_scope(name)
-            # if name in name_space:
-            #     return name_space[name]
-            # else:
-            #     raise Exception("Variable not defined")
-
-        case get(variable):
-            return name_space.get_from_scope(variable.name)
-            # if variable.name in name_space:
-            #     return name_space[variable.name]
-            # else:
-            #     raise Exception("Variable not defined")
-
-        case set(variable, value):
-            name_space.update_scope(variable.name, eval_ast(
-                value, lexical_scope, name_space))
-            # temp = eval_ast(value, lexical_scope, name_space)
-            # name_space[variable.name] = temp
-            return Fraction(0)  # return value of set is always 0
-
-        case update_list(variable, value):
-            name_space.update_scope(variable.name, value)
-            return Fraction(0)
-        case update_dict(variable, value):
-            name_space.update_scope(variable.name, value)
-            return Fraction(0)
-        case update_string(e, value):
-            name_space.update_scope(e.variable.name, value)
-            return Fraction(0)
-
-        # Literals
-        case numeric_literal(value):
-            return value
-        case bool_literal(value):
-            return value
-        case string_literal(value):
-            return value
-        case Lists(value):
-            output_list = []
-            for i in range(len(value)):
-                output_list.append(
-                    eval_ast(value[i], lexical_scope, name_space))
-            return output_list
-        case dict_literal(value):
-            output_dict = {}
-            for i in range(len(value)):
-                output_dict[eval_ast(value[i][0], lexical_scope, name_space)] = eval_ast(
-                    value[i][1], lexical_scope, name_space)
-            return output_dict
-
-        # Arithmetic Operations
-        case binary_operation("+", left, right):
-            a = eval_ast(left, lexical_scope, name_space)
-            b = eval_ast(right, lexical_scope, name_space)
-            if isinstance(a, str):
-                return a+b
-            else:
-                return Fraction(eval_ast(left, lexical_scope, name_space) + eval_ast(right, lexical_scope, name_space))
-        case binary_operation("-", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) - eval_ast(right, lexical_scope, name_space))
-        case binary_operation("*", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) * eval_ast(right, lexical_scope, name_space))
-        case binary_operation("/", left, right):
-            if eval_ast(right, lexical_scope, name_space) == 0:
-                raise Exception("Division by zero")
-            return Fraction(eval_ast(left, lexical_scope, name_space) / eval_ast(right, lexical_scope, name_space))
-        case binary_operation("^", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) ** eval_ast(right, lexical_scope, name_space))
-        case binary_operation("%", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) % eval_ast(right, lexical_scope, name_space))
-        case binary_operation("//", left, right):
-            return Fraction(eval_ast(left, lexical_scope, name_space) // eval_ast(right, lexical_scope, name_space))
-
-        # Boolean Operations
-        case binary_operation("==", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) == eval_ast(right, lexical_scope, name_space))
-        case binary_operation("!=", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) != eval_ast(right, lexical_scope, name_space))
-        case binary_operation("<", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) < eval_ast(right, lexical_scope, name_space))
-        case binary_operation(">", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) > eval_ast(right, lexical_scope, name_space))
-        case binary_operation("&&", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) and eval_ast(right, lexical_scope, name_space))
-        case binary_operation("||", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) or eval_ast(right, lexical_scope, name_space))
-        case binary_operation("or", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) or eval_ast(right, lexical_scope, name_space))
-        case binary_operation("and", left, right):
-            return bool(eval_ast(left, lexical_scope, name_space) and eval_ast(right, lexical_scope, name_space))
-
-        # If Statements
-        case if_statement(condition, if_exp, else_exp):
-            if eval_ast(condition, lexical_scope, name_space):
-                return eval_ast(if_exp, lexical_scope, name_space)
-            else:
-                return eval_ast(else_exp, lexical_scope, name_space)
-
-        # While Loops
-        case while_loop(condition, body):
-            while eval_ast(condition, lexical_scope, name_space):
-                eval_ast(body, lexical_scope, name_space)
-            return Fraction(0)  # return value of while loop is always 0
-
-        # Blocks
-        # using scoping as used in c++, inside loops.
-        case block(exps):
-            # if value of declared variables is changed inside the block, it will be changed outside the block
-            # if new variables are declared inside the block, they will not be accessible outside the block
-            name_space.start_scope()
-            for exp in exps:
-                eval_ast(exp, lexical_scope, name_space)
-            name_space.end_scope()
-            return Fraction(0)  # return value of block is always 0
-
-        # Unary Operations
-        case unary_operation("!", condition):
-            value = eval_ast(condition, lexical_scope, name_space)
+
+# Handlers for each type of node, eval_ast looks them up by the type of the node
+# every handler takes (subprogram, lexical_scope, name_space)
+# the handlers of the most frequent nodes look up the handlers of their children directly
+# instead of going through eval_ast, which saves a python call for every node
+
+def _eval_null(subprogram, lexical_scope, name_space):
+    return 0
+
+
+def _eval_input(subprogram, lexical_scope, name_space):
+    return input(subprogram.string)
+
+
+# Let Expressions
+def _eval_let_var(subprogram, lexical_scope, name_space):
+    if subprogram.name in lexical_scope:
+        return lexical_scope[subprogram.name]
+    else:
+        raise Exception("Variable not defined")
+
+
+def _eval_let(subprogram, lexical_scope, name_space):
+    name = subprogram.variable.name
+    e1 = subprogram.e1
+    e2 = subprogram.e2
+    temp = _HANDLERS[type(e1)](e1, lexical_scope, name_space)
+    # bind in place and restore the shadowed value (if any) afterwards, instead of copying the scope
+    prev = lexical_scope.get(name, _MISSING)
+    lexical_scope[name] = temp
+    try:
+        return _HANDLERS[type(e2)](e2, lexical_scope, name_space)
+    finally:
+        if prev is _MISSING:
+            del lexical_scope[name]
+        else:
+            lexical_scope[name] = prev
+
+
+def _eval_declare(subprogram, lexical_scope, name_space):
+    name_space.add_to_scope(subprogram.variable.name, eval_ast(
+        subprogram.value, lexical_scope, name_space))
+    return 0
+
+
+def _eval_list_initializer(subprogram, lexical_scope, name_space):
+    size = int(eval_ast(subprogram.size, lexical_scope, name_space))
+    value = eval_ast(subprogram.value, lexical_scope, name_space)
+    l = []
+    for i in range(size):
+        l.append(value)
+    return l
+
+
+# eval_ast might never get this node as we are using get, however, it is still here for completeness
+def _eval_identifier(subprogram, lexical_scope, name_space):
+    return name_space.get_from_scope(subprogram.name)
+
+
+def _eval_get(subprogram, lexical_scope, name_space):
+    return name_space.get_from_scope(subprogram.variable.name)
+
+
+def _eval_set(subprogram, lexical_scope, name_space):
+    value = subprogram.value
+    name_space.update_scope(subprogram.variable.name, _HANDLERS[type(
+        value)](value, lexical_scope, name_space))
+    return _ZERO  # return value of set is always 0
+
+
+def _eval_update(subprogram, lexical_scope, name_space):
+    # update_list and update_dict
+    name_space.update_scope(subprogram.variable.name, subprogram.value)
+    return _ZERO
+
+
+def _eval_update_string(subprogram, lexical_scope, name_space):
+    name_space.update_scope(subprogram.variable.variable.name, subprogram.value)
+    return _ZERO
+
+
+# Literals
+def _eval_literal(subprogram, lexical_scope, name_space):
+    return subprogram.value
+
+
+def _eval_list(subprogram, lexical_scope, name_space):
+    output_list = []
+    for exp in subprogram.value:
+        output_list.append(eval_ast(exp, lexical_scope, name_space))
+    return output_list
+
+
+def _eval_dict(subprogram, lexical_scope, name_space):
+    output_dict = {}
+    for key, value in subprogram.value:
+        output_dict[eval_ast(key, lexical_scope, name_space)] = eval_ast(
+            value, lexical_scope, name_space)
+    return output_dict
+
+
+# Arithmetic Operations
+def _number(value):
+    # bools and floats are turned into Fractions, ints, Fractions and strings are kept as they are
+    if type(value) is bool or type(value) is float:
+        return Fraction(value)
+    return value
+
+
+def _add(a, b):
+    if isinstance(a, str):
+        return a+b
+    else:
+        return _number(a + b)
+
+
+def _div(a, b):
+    if b == 0:
+        raise Exception("Division by zero")
+    if type(a) is int and type(b) is int:
+        # exact divisions stay ints
+        if a % b == 0:
+            return a // b
+        return Fraction(a, b)
+    return _number(a / b)
+
+
+def _pow(a, b):
+    if type(a) is int and type(b) is int and b < 0:
+        # int ** negative int would give a float
+        a = Fraction(a)
+    return _number(a ** b)
+
+
+# operator -> function of the two evaluated operands
+_BINOPS = {
+    "+": _add,
+    "-": lambda a, b: _number(a - b),
+    "*": lambda a, b: _number(a * b),
+    "/": _div,
+    "^": _pow,
+    "%": lambda a, b: _number(a % b),
+    "//": lambda a, b: _number(a // b),
+
+    # Boolean Operations
+    "==": lambda a, b: bool(a == b),
+    "!=": lambda a, b: bool(a != b),
+    "<": lambda a, b: bool(a < b),
+    ">": lambda a, b: bool(a > b),
+}
+
+
+def _eval_binary_operation(subprogram, lexical_scope, name_space):
+    operation = _BINOPS.get(subprogram.operator)
+    if operation is not None:
+        left = subprogram.left
+        right = subprogram.right
+        return operation(_HANDLERS[type(left)](left, lexical_scope, name_space),
+                         _HANDLERS[type(right)](right, lexical_scope, name_space))
+    # and/or only evaluate the right operand when the left one does not decide the result
+    match subprogram.operator:
+        case "&&" | "and":
+            return bool(eval_ast(subprogram.left, lexical_scope, name_space) and eval_ast(subprogram.right, lexical_scope, name_space))
+        case "||" | "or":
+            return bool(eval_ast(subprogram.left, lexical_scope, name_space) or eval_ast(subprogram.right, lexical_scope, name_space))
+    ProgramNotSupported()
+
+
+# If Statements
+def _eval_if(subprogram, lexical_scope, name_space):
+    condition = subprogram.condition
+    if _HANDLERS[type(condition)](condition, lexical_scope, name_space):
+        branch = subprogram.if_exp
+    else:
+        branch = subprogram.else_exp
+    return _HANDLERS[type(branch)](branch, lexical_scope, name_space)
+
+
+# While Loops
+def _eval_while(subprogram, lexical_scope, name_space):
+    condition = subprogram.condition
+    body = subprogram.body
+    eval_condition = _HANDLERS[type(condition)]
+    eval_body = _HANDLERS[type(body)]
+    iterations = 0
+    while eval_condition(condition, lexical_scope, name_space):
+        eval_body(body, lexical_scope, name_space)
+        iterations += 1
+        # hot loops run the rest of their iterations as compiled python code
+        if iterations == _JIT_THRESHOLD and _run_compiled(subprogram, lexical_scope, name_space):
+            break
+    return _ZERO  # return value of while loop is always 0
+
+
+# Blocks
+# using scoping as used in c++, inside loops.
+def _binds(subprogram) -> bool:
+    # whether evaluating the node adds names to the scope it runs in,
+    # blocks and for loops add theirs to a scope of their own
+    match subprogram:
+        case declare() | Function():
+            return True
+        case block() | for_loop():
+            return False
+    if not is_dataclass(subprogram):
+        return False
+    return any(_binds(e) for e in children(subprogram))
+
+
+def _scoped(subprogram) -> bool:
+    # a block that declares nothing gets no scope, an empty scope would never be looked up
+    scoped = subprogram.scoped
+    if scoped is None:
+        scoped = subprogram.scoped = any(_binds(e) for e in subprogram.exps)
+    return scoped
+
+
+def _eval_block(subprogram, lexical_scope, name_space):
+    # if value of declared variables is changed inside the block, it will be changed outside the block
+    # if new variables are declared inside the block, they will not be accessible outside the block
+    if _scoped(subprogram):
+        name_space.start_scope()
+        for exp in subprogram.exps:
+            _HANDLERS[type(exp)](exp, lexical_scope, name_space)
+        name_space.end_scope()
+    else:
+        for exp in subprogram.exps:
+            _HANDLERS[type(exp)](exp, lexical_scope, name_space)
+    return _ZERO  # return value of block is always 0
+
+
+# Unary Operations
+def _eval_unary_operation(subprogram, lexical_scope, name_space):
+    operand = subprogram.operand
+    match subprogram.operator:
+        case "!":
+            value = _HANDLERS[type(operand)](operand, lexical_scope, name_space)
             return not value
-        case unary_operation("-", condition):
-            return -(eval_ast(condition, lexical_scope, name_space))
-
-        # String operations
-        case string_concat(string_list):
-            # Initializing an empty string literal
-            final_string = eval_ast(string_literal(
-                ""), lexical_scope, name_space)
-            for i in string_list:
-                # Traversing through the list of stings and concatenating them
-                final_string += eval_ast(i, lexical_scope, name_space)
-            return str(final_string)
-        case string_slice(string, start, stop, hop):
-            # Evaluating the string literal
-            # Converting the factions to int as python only takes int for slicing
-            begin = int(eval_ast(start))
-            end = int(eval_ast(stop))
-            step = int(eval_ast(hop))
-            final_string = eval_ast(string, lexical_scope, name_space)
-            # Doing the appropriate slicing using python's inbuilt slicing method
-            if (end == -1):
-                return str(final_string[begin::step])
-            return str(final_string[begin:end:step])
-
-        # For loops
-        case for_loop(iterator, initial_value, condition, updation, body):
-            name_space.start_scope()
-            eval_ast(declare(iterator, initial_value),
-                     lexical_scope, name_space)
-            while eval_ast(condition, lexical_scope, name_space):
-                eval_ast(body, lexical_scope, name_space)
-                eval_ast(updation, lexical_scope, name_space)
-            name_space.end_scope()
-            return Fraction(0)
-
-        # Print statements
-        case print_statement(expr_list):
-            return_val = ""
-            for expr in expr_list:
-                value = eval_ast(expr, lexical_scope, name_space)
-                return_val += str(value)
-                print(value, end=" ")
-            print("")
-            return return_val
-
-        # Functions
-        case Function(identifier(name), parameters, body, return_exp):
-            name_space.add_to_scope(
-                name, FunctionObject(parameters, body, return_exp))
-            return 0
-
-        case FunctionCall(identifier(name), arguments):
-            function = name_space.get_from_scope(name)
-            argv = []
-            for arg in arguments:
-                argv.append(eval_ast(arg, lexical_scope, name_space))
-            name_space.start_scope()
-            for parameter, arg in zip(function.parameters, argv):
-                name_space.add_to_scope(parameter.name, arg)
-            for exp in function.body.exps:
-                eval_ast(exp, lexical_scope, name_space)
-            return_value = eval_ast(
-                function.return_exp, lexical_scope, name_space)
-            name_space.end_scope()
-            return return_value
-
-        case u_list_operation("self", left):
-            return eval_ast(left, lexical_scope, name_space)
-        case u_list_operation("head", l):
-            our_list = eval_ast(l, lexical_scope, name_space)
+        case "-":
+            return -(_HANDLERS[type(operand)](operand, lexical_scope, name_space))
+    ProgramNotSupported()
+
+
+# String operations
+def _eval_string_concat(subprogram, lexical_scope, name_space):
+    # Traversing through the list of stings and joining them in one go
+    return "".join([eval_ast(i, lexical_scope, name_space) for i in subprogram.operands])
+
+
+def _eval_string_slice(subprogram, lexical_scope, name_space):
+    # Evaluating the string literal
+    # Converting the factions to int as python only takes int for slicing
+    begin = int(eval_ast(subprogram.start, lexical_scope, name_space))
+    end = int(eval_ast(subprogram.stop, lexical_scope, name_space))
+    step = int(eval_ast(subprogram.hop, lexical_scope, name_space))
+    final_string = eval_ast(subprogram.string, lexical_scope, name_space)
+    # Doing the appropriate slicing using python's inbuilt slicing method
+    if (end == -1):
+        return str(final_string[begin::step])
+    return str(final_string[begin:end:step])
+
+
+# For loops
+def _eval_for(subprogram, lexical_scope, name_space):
+    name_space.start_scope()
+    eval_ast(declare(subprogram.iterator, subprogram.initial_value),
+             lexical_scope, name_space)
+    iterations = 0
+    while eval_ast(subprogram.condition, lexical_scope, name_space):
+        eval_ast(subprogram.body, lexical_scope, name_space)
+        eval_ast(subprogram.updation, lexical_scope, name_space)
+        iterations += 1
+        if iterations == _JIT_THRESHOLD and _run_compiled(subprogram, lexical_scope, name_space):
+            break
+    name_space.end_scope()
+    return _ZERO
+
+
+# Print statements
+def _eval_print(subprogram, lexical_scope, name_space):
+    return_val = ""
+    for expr in subprogram.exps:
+        value = eval_ast(expr, lexical_scope, name_space)
+        return_val += str(value)
+        print(value, end=" ")
+    print("")
+    return return_val
+
+
+# Functions
+def _eval_function(subprogram, lexical_scope, name_space):
+    name_space.add_to_scope(
+        subprogram.name.name, FunctionObject(subprogram.parameters, subprogram.body, subprogram.return_exp))
+    return 0
+
+
+def _eval_function_call(subprogram, lexical_scope, name_space):
+    function = name_space.get_from_scope(subprogram.function.name)
+    argv = []
+    for arg in subprogram.arguments:
+        argv.append(eval_ast(arg, lexical_scope, name_space))
+    name_space.start_scope()
+    for parameter, arg in zip(function.parameters, argv):
+        name_space.add_to_scope(parameter.name, arg)
+    for exp in function.body.exps:
+        eval_ast(exp, lexical_scope, name_space)
+    return_value = eval_ast(
+        function.return_exp, lexical_scope, name_space)
+    name_space.end_scope()
+    return return_value
+
+
+def _eval_u_list_operation(subprogram, lexical_scope, name_space):
+    match subprogram.operator:
+        case "self":
+            return eval_ast(subprogram.first, lexical_scope, name_space)
+        case "head":
+            our_list = eval_ast(subprogram.first, lexical_scope, name_space)
             if (len(our_list) == 0):
                 return Null
             return our_list[0]
-        case u_list_operation("tail", l):
-            our_list = eval_ast(l, lexical_scope, name_space)
+        case "tail":
+            our_list = eval_ast(subprogram.first, lexical_scope, name_space)
             return our_list[1:]
-        case u_list_operation("is_empty", l):
-            our_list = eval_ast(l, lexical_scope, name_space)
+        case "is_empty":
+            our_list = eval_ast(subprogram.first, lexical_scope, name_space)
             if (len(our_list) == 0):
                 return True
             return False
+    ProgramNotSupported()
 
-        case b_list_operation("cons", left, l):
+
+def _eval_b_list_operation(subprogram, lexical_scope, name_space):
+    l = subprogram.second
+    match subprogram.operator:
+        case "cons":
             our_list = eval_ast(l, lexical_scope, name_space)
             output_list = []
-            value = eval_ast(left, lexical_scope, name_space)
+            value = eval_ast(subprogram.first, lexical_scope, name_space)
             output_list.append(value)
             for i in range(len(our_list)):
                 output_list.append(our_list[i])
@@ -628,95 +764,364 @@ def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
                 eval_ast(update_list(l, output_list),
                          lexical_scope, name_space)
             return output_list
-        case b_list_operation("append", right, l):
+        case "append":
             our_list = eval_ast(l, lexical_scope, name_space)
-            value = eval_ast(right, lexical_scope, name_space)
+            value = eval_ast(subprogram.first, lexical_scope, name_space)
             our_list.append(value)
             # We might not require to update the list as lists are mutable in python
             # eval_ast(update_list(l, our_list), lexical_scope, name_space)
             return our_list
+    ProgramNotSupported()
 
-        case u_dict_operation("keys", d):
-            our_dict = eval_ast(d, lexical_scope, name_space)
+
+def _eval_u_dict_operation(subprogram, lexical_scope, name_space):
+    match subprogram.operator:
+        case "keys":
+            our_dict = eval_ast(subprogram.first, lexical_scope, name_space)
             return list(our_dict.keys())
-        case u_dict_operation("values", d):
-            our_dict = eval_ast(d, lexical_scope, name_space)
+        case "values":
+            our_dict = eval_ast(subprogram.first, lexical_scope, name_space)
             return list(our_dict.values())
-        case u_dict_operation("items", d):
-            our_dict = eval_ast(d, lexical_scope, name_space)
+        case "items":
+            our_dict = eval_ast(subprogram.first, lexical_scope, name_space)
             return list(our_dict.items())
-        case b_dict_operation("delete", d, key):
-            our_dict = eval_ast(d, lexical_scope, name_space)
-            key = eval_ast(key, lexical_scope, name_space)
+    ProgramNotSupported()
+
+
+def _eval_b_dict_operation(subprogram, lexical_scope, name_space):
+    match subprogram.operator:
+        case "delete":
+            our_dict = eval_ast(subprogram.first, lexical_scope, name_space)
+            key = eval_ast(subprogram.second, lexical_scope, name_space)
             del our_dict[key]
             # eval_ast(update_dict(d, our_dict), lexical_scope, name_space)
             return our_dict
-        case b_dict_operation("check", d, key):
-            our_dict = eval_ast(d, lexical_scope, name_space)
-            key = eval_ast(key, lexical_scope, name_space)
+        case "check":
+            our_dict = eval_ast(subprogram.first, lexical_scope, name_space)
+            key = eval_ast(subprogram.second, lexical_scope, name_space)
             if key in our_dict:
                 return True
             return False
-
-        case length(first):
-            data_structure = eval_ast(first, lexical_scope, name_space)
-            if isinstance(data_structure, list | dict | str):
-                return len(data_structure)
-            else:
-                raise Exception("Invalid type for length")
-        case find(first, second):
-            data_structure = eval_ast(first, lexical_scope, name_space)
-            index = eval_ast(second, lexical_scope, name_space)
-            # Checking type of the datastructure
-            if isinstance(data_structure, list | str):
-                index = int(index)
-                if (index >= len(data_structure)):
-                    raise Exception("Index out of bounds")
-                else:
-                    return data_structure[index]
-            elif isinstance(data_structure, dict):
-                return data_structure.get(index, -1)
-            else:
-                raise Exception("Type does not support lookup")
-
-        case put(first, second, third):
-            data_structure = eval_ast(first, lexical_scope, name_space)
-            index = eval_ast(second, lexical_scope, name_space)
-            value = eval_ast(third, lexical_scope, name_space)
-            # Checking type of the datastructure
-            if isinstance(data_structure, list):
-                index = int(eval_ast(second, lexical_scope, name_space))
-                if (index >= len(data_structure)):
-                    raise Exception("Index out of bounds")
-                value = eval_ast(third, lexical_scope, name_space)
-                data_structure[index] = value
-                # Might not be necessary
-                # eval_ast(update_list(first, data_structure), lexical_scope, name_space)
-                return data_structure
-            elif isinstance(data_structure, dict):
-                index = eval_ast(second, lexical_scope, name_space)
-                value = eval_ast(third, lexical_scope, name_space)
-                data_structure[index] = value
-                # Might not be necessary
-                # eval_ast(update_dict(first, data_structure), lexical_scope, name_space)
-                return data_structure
-            elif isinstance(data_structure, str):
-                index = int(eval_ast(second, lexical_scope, name_space))
-                if (index >= len(data_structure)):
-                    raise Exception("Index out of bounds")
-                value = eval_ast(third, lexical_scope, name_space)
-                data_structure = data_structure[:index] + \
-                    str(value) + data_structure[index+1:]
-                if (isinstance(first, get)):
-                    eval_ast(update_string(first, data_structure),
-                             lexical_scope, name_space)
-                return data_structure
-            else:
-                raise Exception("Type does not support lookup")
-
-    # print(subprogram)
     ProgramNotSupported()
-    return Fraction(0)
+
+
+def _eval_length(subprogram, lexical_scope, name_space):
+    data_structure = eval_ast(subprogram.operand, lexical_scope, name_space)
+    if isinstance(data_structure, list | dict | str):
+        return len(data_structure)
+    else:
+        raise Exception("Invalid type for length")
+
+
+def _eval_find(subprogram, lexical_scope, name_space):
+    data_structure = eval_ast(subprogram.operand, lexical_scope, name_space)
+    index = eval_ast(subprogram.key, lexical_scope, name_space)
+    # Checking type of the datastructure
+    if isinstance(data_structure, list | str):
+        index = int(index)
+        if (index >= len(data_structure)):
+            raise Exception("Index out of bounds")
+        else:
+            return data_structure[index]
+    elif isinstance(data_structure, dict):
+        return data_structure.get(index, -1)
+    else:
+        raise Exception("Type does not support lookup")
+
+
+def _eval_put(subprogram, lexical_scope, name_space):
+    first = subprogram.operand
+    data_structure = eval_ast(first, lexical_scope, name_space)
+    index = eval_ast(subprogram.key, lexical_scope, name_space)
+    value = eval_ast(subprogram.value, lexical_scope, name_space)
+    # Checking type of the datastructure
+    if isinstance(data_structure, list):
+        index = int(index)
+        if (index >= len(data_structure)):
+            raise Exception("Index out of bounds")
+        data_structure[index] = value
+        # Might not be necessary
+        # eval_ast(update_list(first, data_structure), lexical_scope, name_space)
+        return data_structure
+    elif isinstance(data_structure, dict):
+        data_structure[index] = value
+        # Might not be necessary
+        # eval_ast(update_dict(first, data_structure), lexical_scope, name_space)
+        return data_structure
+    elif isinstance(data_structure, str):
+        index = int(index)
+        if (index >= len(data_structure)):
+            raise Exception("Index out of bounds")
+        data_structure = data_structure[:index] + \
+            str(value) + data_structure[index+1:]
+        if (isinstance(first, get)):
+            eval_ast(update_string(first, data_structure),
+                     lexical_scope, name_space)
+        return data_structure
+    else:
+        raise Exception("Type does not support lookup")
+
+
+# Pure subexpressions
+# optimizer.mark_pure gives nodes that only read literals and let variables one of the classes below
+# and stamps them with the names of the let variables they read, such a node always has the same value
+# for the same values of those variables. Only these classes are evaluated through _memoized, every
+# other operation goes to its handler directly
+_MEMO_LIMIT = 4096
+
+
+class pure_binary_operation(binary_operation):
+    pass
+
+
+class pure_unary_operation(unary_operation):
+    pass
+
+
+class pure_string_concat(string_concat):
+    pass
+
+
+class pure_string_slice(string_slice):
+    pass
+
+
+PURE_TYPES = {
+    binary_operation: pure_binary_operation,
+    unary_operation: pure_unary_operation,
+    string_concat: pure_string_concat,
+    string_slice: pure_string_slice,
+}
+
+
+def _memoized(handler):
+    def eval_memoized(subprogram, lexical_scope, name_space):
+        memo = name_space.memo
+        try:
+            key = (id(subprogram), *[lexical_scope[name]
+                   for name in subprogram.free_vars])
+            entry = memo.get(key)
+        except (KeyError, TypeError):
+            # unbound or unhashable variables are left to the handler
+            return handler(subprogram, lexical_scope, name_space)
+        # the entry keeps its node alive, so its id is not reused by another node while cached
+        if entry is None or entry[0] is not subprogram:
+            entry = (subprogram, handler(subprogram, lexical_scope, name_space))
+            if len(memo) >= _MEMO_LIMIT:
+                memo.clear()
+            memo[key] = entry
+        return entry[1]
+    return eval_memoized
+
+
+class _Handlers(dict):
+    # nodes without a handler are not supported
+    def __missing__(self, key):
+        ProgramNotSupported()
+
+
+_HANDLERS = _Handlers({
+    Null: _eval_null,
+    input_statement: _eval_input,
+    let_var: _eval_let_var,
+    let: _eval_let,
+    declare: _eval_declare,
+    list_initializer: _eval_list_initializer,
+    identifier: _eval_identifier,
+    get: _eval_get,
+    set: _eval_set,
+    update_list: _eval_update,
+    update_dict: _eval_update,
+    update_string: _eval_update_string,
+    numeric_literal: _eval_literal,
+    bool_literal: _eval_literal,
+    string_literal: _eval_literal,
+    Lists: _eval_list,
+    dict_literal: _eval_dict,
+    binary_operation: _eval_binary_operation,
+    if_statement: _eval_if,
+    while_loop: _eval_while,
+    block: _eval_block,
+    unary_operation: _eval_unary_operation,
+    string_concat: _eval_string_concat,
+    string_slice: _eval_string_slice,
+    pure_binary_operation: _memoized(_eval_binary_operation),
+    pure_unary_operation: _memoized(_eval_unary_operation),
+    pure_string_concat: _memoized(_eval_string_concat),
+    pure_string_slice: _memoized(_eval_string_slice),
+    for_loop: _eval_for,
+    print_statement: _eval_print,
+    Function: _eval_function,
+    FunctionCall: _eval_function_call,
+    u_list_operation: _eval_u_list_operation,
+    b_list_operation: _eval_b_list_operation,
+    u_dict_operation: _eval_u_dict_operation,
+    b_dict_operation: _eval_b_dict_operation,
+    length: _eval_length,
+    find: _eval_find,
+    put: _eval_put,
+})
+
+
+# Compiling hot loops
+# once a while or for loop has run _JIT_THRESHOLD iterations, it is translated to a python function
+# that runs the remaining iterations. Variables, literals, set, operators, if, while, for and blocks
+# that declare nothing are translated, every other node is evaluated by its handler from that function
+_JIT_THRESHOLD = 50
+_JIT_CACHE_LIMIT = 256
+_jit_cache = {}
+
+
+def jit_codegen(loop):
+    # returns the source of the function running the loop, the constants it takes and
+    # the names of the variables and let variables it expects to be bound when it starts
+    constants = []
+    variables = {}
+    let_vars = {}
+    lines = []
+    temps = 0
+
+    def constant(value) -> str:
+        constants.append(value)
+        return f"k{len(constants) - 1}"
+
+    def scope(name, env) -> str:
+        # the python variable holding the scope dictionary the variable lives in
+        if name in env:
+            return env[name]
+        if name not in variables:
+            variables[name] = f"s{len(variables)}"
+        return variables[name]
+
+    def delegate(subprogram) -> str:
+        handler = _HANDLERS.get(type(subprogram), eval_ast)
+        return f"{constant(handler)}({constant(subprogram)}, _ls, _ns)"
+
+    def expr(subprogram, env) -> str:
+        match subprogram:
+            case numeric_literal(value) | bool_literal(value) | string_literal(value):
+                return constant(value)
+            case get(identifier(name)):
+                return f"{scope(name, env)}[{name!r}]"
+            case let_var(name):
+                if name not in let_vars:
+                    let_vars[name] = f"l{len(let_vars)}"
+                return let_vars[name]
+            case binary_operation(op, left, right) if op in _BINOPS:
+                return f"{constant(_BINOPS[op])}({expr(left, env)}, {expr(right, env)})"
+            case binary_operation("&&" | "and", left, right):
+                return f"bool({expr(left, env)} and {expr(right, env)})"
+            case binary_operation("||" | "or", left, right):
+                return f"bool({expr(left, env)} or {expr(right, env)})"
+            case unary_operation("!", operand):
+                return f"(not {expr(operand, env)})"
+            case unary_operation("-", operand):
+                return f"(-{expr(operand, env)})"
+        return delegate(subprogram)
+
+    def stmt(subprogram, env, indent):
+        nonlocal temps
+        pad = "    " * indent
+        match subprogram:
+            case set(identifier(name), value):
+                lines.append(
+                    f"{pad}{scope(name, env)}[{name!r}] = {expr(value, env)}")
+                return
+            case block(exps) if not _scoped(subprogram):
+                for e in exps:
+                    stmt(e, env, indent)
+                if not exps:
+                    lines.append(f"{pad}pass")
+                return
+            case while_loop(condition, body):
+                lines.append(f"{pad}while {expr(condition, env)}:")
+                stmt(body, env, indent + 1)
+                return
+            case if_statement(condition, if_exp, else_exp) if else_exp is not None:
+                # without an else the handler is used, it reports the missing branch when it is taken
+                lines.append(f"{pad}if {expr(condition, env)}:")
+                stmt(if_exp, env, indent + 1)
+                lines.append(f"{pad}else:")
+                stmt(else_exp, env, indent + 1)
+                return
+            case for_loop(identifier(name), initial_value, condition, updation, body):
+                temp = f"t{temps}"
+                temps += 1
+                lines.append(f"{pad}_ns.start_scope()")
+                lines.append(
+                    f"{pad}_ns.add_to_scope({name!r}, {expr(initial_value, env)})")
+                lines.append(f"{pad}{temp} = _ns.scopes[-1]")
+                env = {**env, name: temp}
+                lines.append(f"{pad}while {expr(condition, env)}:")
+                stmt(body, env, indent + 1)
+                stmt(updation, env, indent + 1)
+                lines.append(f"{pad}_ns.end_scope()")
+                return
+            case Null():
+                lines.append(f"{pad}pass")
+                return
+        lines.append(f"{pad}{expr(subprogram, env)}")
+
+    match loop:
+        case while_loop(condition, body):
+            stmt(loop, {}, 1)
+        case for_loop(_, _, condition, updation, body):
+            # the scope of the iterator already exists when the loop gets hot
+            lines.append(f"    while {expr(condition, {})}:")
+            stmt(body, {}, 2)
+            stmt(updation, {}, 2)
+
+    prologue = ["def loop(_ls, _ns, _scopes, _k):"]
+    if constants:
+        prologue.append(f"    {', '.join(f'k{i}' for i in range(len(constants)))}, = _k")
+    if variables:
+        prologue.append(f"    {', '.join(variables.values())}, = _scopes")
+    for name, v in let_vars.items():
+        prologue.append(f"    {v} = _ls[{name!r}]")
+    return "\n".join(prologue + lines) + "\n", constants, list(variables), list(let_vars)
+
+
+def jit_compile(loop):
+    source, constants, variables, let_vars = jit_codegen(loop)
+    namespace = {}
+    exec(compile(source, "<jit>", "exec"), namespace)
+    return namespace["loop"], constants, variables, let_vars
+
+
+def _run_compiled(loop, lexical_scope, name_space) -> bool:
+    # runs the rest of the loop as python code, returns False if it can not be used
+    entry = _jit_cache.get(id(loop))
+    if entry is None or entry[0] is not loop:
+        entry = (loop, jit_compile(loop))
+        # the entries keep their loops alive, so the cache is emptied rather than left to grow
+        if len(_jit_cache) >= _JIT_CACHE_LIMIT:
+            _jit_cache.clear()
+        _jit_cache[id(loop)] = entry
+    function, constants, variables, let_vars = entry[1]
+    scopes = []
+    for name in variables:
+        for scope in reversed(name_space.scopes):
+            if name in scope:
+                scopes.append(scope)
+                break
+        else:
+            # the interpreter reports undefined variables when it reaches them
+            return False
+    for name in let_vars:
+        if name not in lexical_scope:
+            return False
+    function(lexical_scope, name_space, scopes, constants)
+    return True
+
+
+# the name_space dictionary acts as a global variable
+def eval_ast(subprogram: AST, lexical_scope=None, name_space=None) -> Value:
+    if lexical_scope is None:
+        lexical_scope = {}
+    if name_space is None:
+        name_space = environment()
+    return _HANDLERS[type(subprogram)](subprogram, lexical_scope, name_space)
+
 
 # Tests
 
@@ -1231,6 +1636,122 @@ def test0():
     assert (eval_ast(e3, None, name_space) == 11)
 
 
+def test20():
+    # let bindings are undone once the body is evaluated, shadowed values come back
+    lexical_scope = {}
+    x = let_var.make("x")
+    inner = let(x, numeric_literal(5), binary_operation("*", x, numeric_literal(2)))
+    e = let(x, numeric_literal(4), binary_operation("+", inner, x))
+    assert eval_ast(e, lexical_scope) == 14
+    assert lexical_scope == {}
+
+
+def test21():
+    # operands are evaluated once and with the current environment
+    name_space = environment()
+    d = identifier.make("d")
+    n = identifier.make("n")
+    eval_ast(declare(d, numeric_literal(4)), None, name_space)
+    eval_ast(declare(n, numeric_literal(0)), None, name_space)
+    count = set(n, binary_operation("+", get(n), numeric_literal(1)))
+    divisor = FunctionCall(identifier.make("f"), [])
+    eval_ast(Function(identifier.make("f"), [], block([count]), get(d)), None, name_space)
+    assert eval_ast(binary_operation("/", numeric_literal(10), divisor), None, name_space) == Fraction(5, 2)
+    assert eval_ast(get(n), None, name_space) == 1
+    assert eval_ast(string_slice(string_literal("HelloWorld"), get(d), binary_operation("+", get(d), get(d))),
+                    None, name_space) == "oWor"
+    try:
+        eval_ast(binary_operation("/", numeric_literal(1), binary_operation("-", get(d), get(d))), None, name_space)
+        assert False
+    except Exception as e:
+        assert str(e) == "Division by zero"
+
+
+def test22():
+    # loops running past _JIT_THRESHOLD iterations finish as compiled code with the same results
+    name_space = environment()
+    i = identifier.make("i")
+    j = identifier.make("j")
+    total = identifier.make("total")
+    t = identifier.make("t")
+    for v in (i, total):
+        eval_ast(declare(v, numeric_literal(0)), None, name_space)
+    inner = for_loop(j, numeric_literal(0), binary_operation("<", get(j), get(i)),
+                     set(j, binary_operation("+", get(j), numeric_literal(1))),
+                     block([declare(t, binary_operation("*", get(j), numeric_literal(2))),
+                            set(total, binary_operation("+", get(total), get(t)))]))
+    body = block([set(i, binary_operation("+", get(i), numeric_literal(1))), inner])
+    loop = while_loop(binary_operation("<", get(i), numeric_literal(100)), body)
+    eval_ast(loop, None, name_space)
+    assert id(loop) in _jit_cache
+    assert eval_ast(get(i), None, name_space) == 100
+    assert eval_ast(get(total), None, name_space) == sum(j * (j - 1) for j in range(101))
+    assert len(name_space.scopes) == 1
+
+    # the block declaring t is evaluated by its handler
+    source = jit_codegen(loop)[0]
+    assert "_ns.start_scope()" in source and "add_to_scope('t'" not in source
+
+
+def test23():
+    # only blocks that declare something get a scope of their own
+    name_space = environment()
+    i = identifier.make("i")
+    j = identifier.make("j")
+    eval_ast(declare(i, numeric_literal(0)), None, name_space)
+    inner = block([declare(j, get(i)), set(i, binary_operation("+", get(j), numeric_literal(1)))])
+    outer = block([inner, if_statement(bool_literal(True), block([]), None)])
+    loop = while_loop(binary_operation("<", get(i), numeric_literal(3)), outer)
+    eval_ast(loop, None, name_space)
+    assert eval_ast(get(i), None, name_space) == 3
+    assert inner.scoped and not outer.scoped
+    assert len(name_space.scopes) == 1
+    try:
+        eval_ast(get(j), None, name_space)
+        assert False
+    except Exception as e:
+        assert str(e) == "Variable not defined"
+
+
+def test24():
+    # whole number literals and arithmetic stay ints until a division is not exact
+    assert type(numeric_literal(6).value) is int
+    assert numeric_literal(1, 2).value == Fraction(1, 2)
+    e = binary_operation("/", numeric_literal(6), numeric_literal(3))
+    assert eval_ast(e) == 2 and type(eval_ast(e)) is int
+    e = binary_operation("/", numeric_literal(7), numeric_literal(2))
+    assert eval_ast(e) == Fraction(7, 2)
+    e = binary_operation("*", e, numeric_literal(2))
+    assert eval_ast(e) == 7
+    e = binary_operation("^", numeric_literal(3), numeric_literal(-1))
+    assert eval_ast(e) == Fraction(1, 3)
+    # strings are not turned into numbers by a division
+    e = binary_operation("/", string_literal("10"), numeric_literal(4))
+    try:
+        eval_ast(e)
+        assert False
+    except TypeError:
+        pass
+
+
+def test25():
+    # an if without an else inside a compiled loop fails like the interpreter when the else is taken
+    name_space = environment()
+    i = identifier.make("i")
+    eval_ast(declare(i, numeric_literal(0)), None, name_space)
+    branch = if_statement(binary_operation("<", get(i), numeric_literal(60)), block([]), None)
+    loop = while_loop(binary_operation("<", get(i), numeric_literal(100)),
+                      block([set(i, binary_operation("+", get(i), numeric_literal(1))), branch]))
+    assert "if " not in jit_codegen(loop)[0]
+    try:
+        eval_ast(loop, None, name_space)
+        assert False
+    except Exception as e:
+        assert str(e).startswith("Program not supported")
+    assert eval_ast(get(i), None, name_space) == 60
+    assert id(loop) in _jit_cache
+
+
 # test0()
 # test1()
 # test2()
@@ -1251,3 +1772,9 @@ def test0():
 # test17()
 # test18()
 # test19()
+# test20()
+# test21()
+# test22()
+# test23()
+# test24()
+# test25()
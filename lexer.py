@@ -1,4 +1,7 @@
+import re
+import sys
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Union
 
 
@@ -20,46 +23,17 @@ class TokenError(Exception):
         return f"{self.message} at line {self.line}, column {self.column}"
 
 
-@dataclass
 class Stream:
-    source: str
-    pos: int = 0
-    line: int = 1
-    column: int = 1
+    # the source is handed to tokenize as a whole, characters are not read one at a time
+    __slots__ = ("source", "pos")
+
+    def __init__(self, source, pos=0):
+        self.source = source
+        self.pos = pos
 
     @classmethod
     def streamFromString(cls, s):
-        return cls(s, 0, 1, 1)
-
-    def next_char(self) -> str:
-        if self.pos >= len(self.source):
-            raise EndOfTokens()
-
-        c = self.source[self.pos]
-        if c == "\n":
-            self.line += 1
-            self.column = 1
-        else:
-            self.column += 1
-
-        self.pos += 1
-        return c
-
-    def prev_char(self):
-        assert self.pos > 0
-        self.pos -= 1
-        c = self.source[self.pos]
-        if c == "\n":
-            self.line -= 1
-            # Find the previous non-empty line and set the column accordingly
-            for i in range(self.pos - 1, -1, -1):
-                if self.source[i] == "\n":
-                    break
-                if not self.source[i].isspace():
-                    self.column = self.pos - i
-                    break
-        else:
-            self.column -= 1
+        return cls(s, 0)
 
 # The different types of tokens
 
@@ -104,15 +78,6 @@ class null:
     name: str
 
 
-@dataclass
-class boolValue:
-    name: str
-
-
-TokenType = Num | Keyword | Identifier | Operator | EndOfLine | String | functionName | null | boolValue
-keywords = "pass def print var True False if else then for while return end do let in pass def print var True False if else then for while return end do List let in head tail cons length delete keys values items list append iskey input".split()
-
-
 @dataclass
 class boolValue:
     name: str
@@ -124,181 +89,95 @@ operators = ", . ; + - * % > < / >= <= == ! != ** ^ ( ) [ ] = and or not } ;; {
 )
 white_space = " \t\n"
 
+# built once, so checking a word is a hash lookup instead of a scan of the lists
+KEYWORDS = frozenset(keywords)
+OPERATORS = frozenset(operators)
+
+# token type of each reserved word that is not followed by "(", any other word is an Identifier
+WORD_TOKENS = {word: Operator for word in OPERATORS if word.isalpha()}
+WORD_TOKENS.update({word: Keyword for word in KEYWORDS})
+WORD_TOKENS.update({"pass": null, "True": boolValue, "False": boolValue})
+
+# One pattern for every token, the regex engine does the scanning and the group that matched tells the token type.
+# Only the single character operators above (and ==, !=, >=, <=, ^^, //) are recognised,
+# a string that is never closed ends the tokens like the end of the source does.
+token_pattern = re.compile(r"""
+    [ \t\n]+
+  | (?P<num>\d+)
+  | (?P<word>[^\W\d]\w*)
+  | "(?P<string>[^"]*)"
+  | (?P<op>==|!=|>=|<=|\^\^|//|[,.;+\-*%><=!^()\[\]}{:/])
+  | (?P<unterminated>")
+  | (?P<error>.)
+""", re.VERBOSE | re.DOTALL)
+
+# ^^ is the lexer's spelling of **
+renamed_operators = {"^^": "**"}
+
+
+def word_token(word: str, is_call: bool) -> TokenType:
+    # names are interned so that the dictionaries keyed by them compare them by identity
+    word = sys.intern(word)
+    if is_call:
+        if word in KEYWORDS:
+            return Keyword(word)
+        return functionName(word)
+    return WORD_TOKENS.get(word, Identifier)(word)
+
+
+# numbers of the groups of token_pattern, tokenize branches on the number of the group that matched
+NUM = token_pattern.groupindex["num"]
+WORD = token_pattern.groupindex["word"]
+STRING = token_pattern.groupindex["string"]
+OP = token_pattern.groupindex["op"]
+UNTERMINATED = token_pattern.groupindex["unterminated"]
+
+
+def iter_tokens(source: str):
+    # yields the tokens of the source, ending with EndOfLine
+    for m in token_pattern.finditer(source):
+        # whitespace matches no group, the branches are in the order the tokens are most frequent
+        index = m.lastindex
+        if index is None:
+            continue
+        elif index == OP:
+            op = m.group(index)
+            yield Operator(renamed_operators.get(op, op))
+        elif index == WORD:
+            yield word_token(m.group(index), source.startswith("(", m.end()))
+        elif index == NUM:
+            yield Num(int(m.group(index)))
+        elif index == STRING:
+            yield String(m.group(index))
+        elif index == UNTERMINATED:
+            break
+        else:
+            pos = m.end()
+            raise TokenError("Invalid token", source.count("\n", 0, pos) + 1, pos - source.rfind("\n", 0, pos))
+    yield EndOfLine("EndOfLine")
+
+
+@lru_cache(maxsize=256)
+def tokenize(source: str) -> tuple:
+    # sources are immutable strings, so a source that was lexed before gets the same tokens back
+    return tuple(iter_tokens(source))
+
 
 @dataclass
 class lexer:
     stream = None
+    tokens = None
     save: TokenType = None
 
     def lexerFromStream(s):
         self = lexer()
         self.stream = s
+        self.tokens = iter(tokenize(s.source))
         return self
 
-    def number(self, c: str) -> Num:
-        n = int(c)
-        while True:
-            try:
-                c = self.stream.next_char()
-                if c.isdigit():
-                    n = n * 10 + int(c)
-                else:
-                    self.stream.prev_char()
-                    return Num(n)
-            except EndOfTokens:
-                return Num(n)
-
-    def identifier(self, c: str) -> Identifier:
-        word = c
-        while True:
-            try:
-                c = self.stream.next_char()
-                if c.isalpha() or c == "_" or c.isdigit():
-                    word = word + c
-                elif c == "(":
-
-                    self.stream.prev_char()
-                    if word in keywords:
-                        return Keyword(word)
-                    return functionName(word)
-
-                else:
-                    self.stream.prev_char()
-                    if word in keywords:
-                        if word == "pass":
-                            return null(word)
-                        elif word == "True" or word == "False":
-                            return boolValue(word)
-                        elif word == "True" or word == "False":
-                            return boolValue(word)
-                        else:
-                            return Keyword(word)
-                    elif word in operators:
-                        return Operator(word)
-                    else:
-                        return Identifier(word)
-            except EndOfTokens:
-                if word in keywords:
-                    if word == "pass":
-                        return null(word)
-                    elif word == "True" or word == "False":
-                        return boolValue(word)
-                    elif word == "True" or word == "False":
-                        return boolValue(word)
-                    else:
-                        return Keyword(word)
-                elif word in operators:
-                    return Operator(word)
-                else:
-                    return Identifier(word)
-
-    def string(self) -> String:
-        s = ""
-        while True:
-            try:
-                c = self.stream.next_char()
-                if c == '"':
-                    return String(s)
-                else:
-                    s = s + c
-            except EndOfTokens:
-                raise EndOfTokens()
-
-    def operator(self, c: str) -> Operator:
-        if c == "=":
-            c = self.stream.next_char()
-            if c == "=":
-                return Operator("==")
-            else:
-                self.stream.prev_char()
-                return Operator("=")
-        elif c == "!":
-            c = self.stream.next_char()
-            if c == "=":
-                return Operator("!=")
-            else:
-                self.stream.prev_char()
-                return Operator("!")
-        elif c == ">":
-            c = self.stream.next_char()
-            if c == "=":
-                return Operator(">=")
-            else:
-                self.stream.prev_char()
-                return Operator(">")
-        elif c == "<":
-            c = self.stream.next_char()
-            if c == "=":
-                return Operator("<=")
-            else:
-                self.stream.prev_char()
-                return Operator("<")
-        elif c == "&":
-            c = self.stream.next_char()
-            if c == "&":
-                return Operator("and")
-            else:
-                self.stream.prev_char()
-                return Operator("&")
-        elif c == "|":
-            c = self.stream.next_char()
-            if c == "|":
-                return Operator("or")
-            else:
-                self.stream.prev_char()
-                return Operator("|")
-        elif c == "&":
-            c = self.stream.next_char()
-            if c == "&":
-                return Operator("and")
-            else:
-                self.stream.prev_char()
-                return Operator("&")
-        elif c == "|":
-            c = self.stream.next_char()
-            if c == "|":
-                return Operator("or")
-            else:
-                self.stream.prev_char()
-                return Operator("|")
-        elif c == "^":
-            c = self.stream.next_char()
-            if c == "^":
-                return Operator("**")
-            else:
-                self.stream.prev_char()
-                return Operator("^")
-        elif c == "/":
-            c = self.stream.next_char()
-            if c == "/":
-                return Operator("//")
-            else:
-                self.stream.prev_char()
-                return Operator("/")
-        else:
-            return Operator(c)
-
     def next_token(self) -> TokenType:
-        try:
-            c = self.stream.next_char()
-            match c:
-                case c if c in operators:
-                    return self.operator(c)
-                case c if c.isdigit():
-                    return self.number(c)
-                case c if c.isalpha() or c == "_":
-                    return self.identifier(c)
-                case c if c == '"':
-                    return self.string()
-                case c if c in white_space:
-                    return self.next_token()
-
-        except EndOfTokens:
-            return EndOfLine("EndOfLine")
-            # raise EndOfTokens()
-            # raise EndOfTokens()
-
-        raise TokenError("Invalid token", self.stream.line, self.stream.column)
+        # once the tokens run out every further call gets EndOfLine
+        return next(self.tokens, EndOfLine("EndOfLine"))
 
     #  will be used in lexing
 
@@ -468,3 +347,61 @@ def lexing_test11():
             print(token)
     except TokenError as e:
         print(e)
+
+
+def lexing_test12():
+    import glob
+    import os
+
+    def scan_by_char(source: str):
+        # the tokens read one character at a time and classified by the str methods, token_pattern has to agree
+        pos = 0
+        while pos < len(source):
+            c = source[pos]
+            end = pos + 1
+            if c in white_space:
+                pos = end
+                continue
+            if c.isdigit():
+                while end < len(source) and source[end].isdigit():
+                    end += 1
+                yield Num(int(source[pos:end]))
+            elif c.isalpha() or c == "_":
+                while end < len(source) and (source[end].isalnum() or source[end] == "_"):
+                    end += 1
+                yield word_token(source[pos:end], source.startswith("(", end))
+            elif c == '"':
+                end = source.find('"', end)
+                if end < 0:
+                    break
+                end += 1
+                yield String(source[pos + 1:end - 1])
+            elif source[pos:pos + 2] in ("==", "!=", ">=", "<=", "^^", "//"):
+                end += 1
+                yield Operator(renamed_operators.get(source[pos:end], source[pos:end]))
+            elif c in OPERATORS:
+                yield Operator(c)
+            else:
+                raise TokenError("Invalid token", source.count("\n", 0, end) + 1, end - source.rfind("\n", 0, end))
+            pos = end
+        yield EndOfLine("EndOfLine")
+
+    sources = [open(f).read() for f in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "tester", "*.txt")))]
+    sources += ["var café = 1; print café;", "_x1 x_1 1x ünïcödé_2 Ωmega", "a=b==c!=d<=e>=f^^g//h/i",
+                "f(x) f (x) if(", "\"naïve\" \"\"", "pass True False and or not", "٣4 + 5", "x = \"open"]
+    for source in sources:
+        assert tokenize(source) == tuple(scan_by_char(source)), source
+    assert tokenize("var café = 1;")[1] == Identifier("café")
+    for source in ("a $ b", "é\n  @"):
+        try:
+            tokenize(source)
+            assert False
+        except TokenError as e:
+            try:
+                tuple(scan_by_char(source))
+                assert False
+            except TokenError as expected:
+                assert (e.line, e.column) == (expected.line, expected.column)
+
+
+# lexing_test12()
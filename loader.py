@@ -1,8 +1,8 @@
-import lexer as l
 import Parser as p
 import eval as e
 import typechecking as t
 import resolver as r
+import optimizer as o
 import os
 import bytecode as b
 
@@ -11,10 +11,10 @@ def main(filename):
     with open(filename) as f:
         code = f.read()
     code = '{' + code + '}'
-    stream = l.Stream.streamFromString(code)
-    tokens = l.lexer.lexerFromStream(stream)
-    parse = p.Parser.call_parser(tokens)
-    ast = p.Parser.parse_expr(parse)
+    ast = p.parse_cached(code)
+    ast = o.fold(ast)
+    ast = o.hoist_invariants(ast)
+    o.mark_pure(ast)
 
    # resolvedast = r.resolve(ast)
     # print(ast)
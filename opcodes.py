@@ -0,0 +1,50 @@
+# integer opcodes, the VM dispatches on these instead of matching on the instruction dataclasses,
+# opcodes.pxd declares the same numbers as C constants for the Cython build of dispatch.py
+OP_PUSH = 0
+OP_LOAD = 1
+OP_STORE = 2
+OP_JMP = 3
+OP_JMP_IF_FALSE = 4
+OP_JMP_IF_TRUE = 5
+OP_ADD = 6
+OP_SUB = 7
+OP_MUL = 8
+OP_DIV = 9
+OP_EXP = 10
+OP_QUOT = 11
+OP_REM = 12
+OP_EQ = 13
+OP_NEQ = 14
+OP_LT = 15
+OP_GT = 16
+OP_LE = 17
+OP_GE = 18
+OP_NOT = 19
+OP_UMINUS = 20
+OP_DUP = 21
+OP_POP = 22
+OP_PRINT = 23
+OP_STRCAT = 24
+OP_STRSLICE = 25
+OP_BUILD_LIST = 26
+OP_INIT_LIST = 27
+OP_LIST_HEAD = 28
+OP_LIST_TAIL = 29
+OP_LIST_EMPTY = 30
+OP_LIST_CONS = 31
+OP_LIST_APPEND = 32
+OP_BUILD_DICT = 33
+OP_DICT_KEYS = 34
+OP_DICT_VALUES = 35
+OP_DICT_ITEMS = 36
+OP_DICT_DELETE = 37
+OP_LENGTH = 38
+OP_FIND = 39
+OP_PUT = 40
+OP_INPUT = 41
+OP_PUSHFN = 42
+OP_CALL = 43
+OP_RETURN = 44
+OP_HALT = 45
+OP_QUOT_I = 46
+OP_REM_I = 47
@@ -0,0 +1,433 @@
+import builtins
+import copy
+from dataclasses import fields, is_dataclass
+from fractions import Fraction
+from eval import *
+from eval import _BINOPS
+
+
+# constant folding
+
+def make_literal(value) -> AST:
+    match value:
+        case bool():
+            return bool_literal(value)
+        case str():
+            return string_literal(value)
+        case Fraction() | int():
+            return numeric_literal(value)
+    return None
+
+
+def is_literal(subprogram: AST) -> bool:
+    return isinstance(subprogram, numeric_literal | bool_literal | string_literal)
+
+
+# powers are only folded while their value has at most this many bits, larger ones might take
+# long to work out and the code computing them may never run
+MAX_FOLDED_POWER_BITS = 1024
+
+
+def is_small_power(base, exponent) -> bool:
+    if not isinstance(base, int | Fraction) or not isinstance(exponent, int | Fraction):
+        # anything else is left to _BINOPS
+        return True
+    if isinstance(exponent, Fraction) and exponent.denominator != 1:
+        return False
+    base = Fraction(base)
+    bits = max(base.numerator.bit_length(), base.denominator.bit_length())
+    return bits * abs(int(exponent)) <= MAX_FOLDED_POWER_BITS
+
+
+# repeated strings are only folded while they have at most this many characters
+MAX_FOLDED_STRING_LENGTH = 4096
+
+
+def is_short_repeat(a, b) -> bool:
+    if isinstance(a, str) and isinstance(b, int):
+        return len(a) * abs(b) <= MAX_FOLDED_STRING_LENGTH
+    if isinstance(b, str) and isinstance(a, int):
+        return len(b) * abs(a) <= MAX_FOLDED_STRING_LENGTH
+    return True
+
+
+def fold(subprogram: AST) -> AST:
+    # replaces every operation whose operands are all literals by the literal it evaluates to
+    match subprogram:
+        case binary_operation(op, left, right):
+            fleft = fold(left)
+            fright = fold(right)
+            if op in _BINOPS and is_literal(fleft) and is_literal(fright) and \
+                    (op != "^" or is_small_power(fleft.value, fright.value)) and \
+                    (op != "*" or is_short_repeat(fleft.value, fright.value)):
+                try:
+                    folded = make_literal(_BINOPS[op](fleft.value, fright.value))
+                except Exception:
+                    # errors like division by zero are left to be raised when the program runs
+                    folded = None
+                if folded is not None:
+                    return folded
+            return binary_operation(op, fleft, fright)
+        case unary_operation(op, operand):
+            foperand = fold(operand)
+            if op == "-" and isinstance(foperand, numeric_literal):
+                return numeric_literal(-foperand.value)
+            if op == "!" and isinstance(foperand, bool_literal):
+                return bool_literal(not foperand.value)
+            return unary_operation(op, foperand)
+        case string_concat(operands):
+            foperands = [fold(e) for e in operands]
+            if all(isinstance(e, string_literal) for e in foperands):
+                return string_literal("".join([e.value for e in foperands]))
+            return string_concat(foperands)
+
+        case let(variable, e1, e2):
+            return let(variable, fold(e1), fold(e2))
+        case declare(variable, value):
+            return declare(variable, fold(value))
+        case set(variable, value):
+            return set(variable, fold(value))
+        case list_initializer(size, value):
+            return list_initializer(fold(size), fold(value))
+        case Lists(value):
+            return Lists([fold(e) for e in value])
+        case dict_literal(value):
+            return dict_literal([(fold(k), fold(v)) for k, v in value])
+        case if_statement(condition, if_exp, else_exp):
+            return if_statement(fold(condition), fold(if_exp), fold(else_exp))
+        case while_loop(condition, body):
+            return while_loop(fold(condition), fold(body))
+        case for_loop(iterator, initial_value, condition, updation, body):
+            return for_loop(iterator, fold(initial_value), fold(condition), fold(updation), fold(body))
+        case block(exps):
+            return block([fold(e) for e in exps])
+        case print_statement(exps):
+            return print_statement([fold(e) for e in exps])
+        case string_slice(string, start, stop, hop):
+            return string_slice(fold(string), fold(start), fold(stop), fold(hop))
+        case Function(name, parameters, body, return_exp):
+            return Function(name, parameters, fold(body), fold(return_exp))
+        case FunctionCall(function, arguments):
+            return FunctionCall(function, [fold(e) for e in arguments])
+        case u_list_operation(op, first):
+            return u_list_operation(op, fold(first))
+        case b_list_operation(op, first, second):
+            return b_list_operation(op, fold(first), fold(second))
+        case u_dict_operation(op, first):
+            return u_dict_operation(op, fold(first))
+        case b_dict_operation(op, first, second):
+            return b_dict_operation(op, fold(first), fold(second))
+        case length(operand):
+            return length(fold(operand))
+        case find(operand, key):
+            return find(fold(operand), fold(key))
+        case put(operand, key, value):
+            return put(fold(operand), fold(key), fold(value))
+
+    # literals, variables and anything else without subexpressions
+    return subprogram
+
+
+# purity
+
+# operations whose value only depends on the values of their operands
+PURE_OPERATIONS = tuple(PURE_TYPES)
+
+
+def mark_pure(subprogram: AST):
+    # gives pure operations (only literals and let variables under them) their class from PURE_TYPES and
+    # stamps them with the let variables they read, eval_ast caches their values, returns those
+    # variables or None if impure
+    match subprogram:
+        case numeric_literal() | bool_literal() | string_literal():
+            return frozenset()
+        case let_var(name):
+            return frozenset([name])
+    if not is_dataclass(subprogram):
+        return None
+    free_vars = [mark_pure(e) for e in children(subprogram)]
+    if isinstance(subprogram, PURE_OPERATIONS) and None not in free_vars:
+        free_vars = frozenset().union(*free_vars)
+        # nodes of a cached program may have been marked before
+        if type(subprogram) in PURE_TYPES:
+            subprogram.__class__ = PURE_TYPES[type(subprogram)]
+        subprogram.free_vars = tuple(free_vars)
+        return free_vars
+    return None
+
+
+# loop invariant conditions
+
+def written_vars(subprogram: AST):
+    # names of the variables a subprogram may assign, None if it can change any of them
+    # (function calls and operations that mutate lists, dicts or strings in place)
+    match subprogram:
+        case FunctionCall() | put() | b_list_operation() | b_dict_operation():
+            return None
+        case set(identifier(name)) | declare(identifier(name)):
+            written = {name}
+        case update_list(identifier(name)) | update_dict(identifier(name)):
+            written = {name}
+        case update_string(get(identifier(name))):
+            written = {name}
+        case for_loop(identifier(name)) | Function(identifier(name)):
+            written = {name}
+        case _:
+            written = builtins.set()
+    if not is_dataclass(subprogram):
+        return written
+    for e in children(subprogram):
+        w = written_vars(e)
+        if w is None:
+            return None
+        written |= w
+    return written
+
+
+def is_invariant(subprogram: AST, written) -> bool:
+    match subprogram:
+        case numeric_literal() | bool_literal() | string_literal() | let_var():
+            return True
+        case get(identifier(name)) | identifier(name):
+            return name not in written
+        case binary_operation(_, left, right):
+            return is_invariant(left, written) and is_invariant(right, written)
+        case unary_operation(_, operand) | length(operand):
+            return is_invariant(operand, written)
+        case find(operand, key):
+            return is_invariant(operand, written) and is_invariant(key, written)
+        case string_concat(operands):
+            return all(is_invariant(e, written) for e in operands)
+        case string_slice(string, start, stop, hop):
+            return all(is_invariant(e, written) for e in (string, start, stop, hop))
+    return False
+
+
+def hoist_condition(condition: AST, written, bindings) -> AST:
+    # replaces the largest invariant operations in the condition by let variables,
+    # their definitions are appended to bindings
+    match condition:
+        case numeric_literal() | bool_literal() | string_literal() | let_var() | get() | identifier():
+            return condition
+    if is_invariant(condition, written):
+        n = fresh()
+        v = let_var(f"invariant.{n}", n)
+        bindings.append((v, condition))
+        return v
+    match condition:
+        case binary_operation(op, left, right):
+            hleft = hoist_condition(left, written, bindings)
+            # the right operand of and/or might never be evaluated, so nothing is hoisted from it
+            if op not in ("&&", "and", "||", "or"):
+                right = hoist_condition(right, written, bindings)
+            return binary_operation(op, hleft, right)
+        case unary_operation(op, operand):
+            return unary_operation(op, hoist_condition(operand, written, bindings))
+        case length(operand):
+            return length(hoist_condition(operand, written, bindings))
+        case find(operand, key):
+            return find(hoist_condition(operand, written, bindings), hoist_condition(key, written, bindings))
+        case string_concat(operands):
+            return string_concat([hoist_condition(e, written, bindings) for e in operands])
+        case string_slice(string, start, stop, hop):
+            return string_slice(*[hoist_condition(e, written, bindings) for e in (string, start, stop, hop)])
+    return condition
+
+
+def _hoist_item(e):
+    # list items are nodes or tuples of nodes (the pairs of a dict literal)
+    if not isinstance(e, tuple):
+        return hoist_invariants(e)
+    hoisted = tuple(hoist_invariants(x) for x in e)
+    return e if all(a is b for a, b in zip(hoisted, e)) else hoisted
+
+
+def hoist_invariants(subprogram: AST) -> AST:
+    # evaluates the parts of while conditions that the loop can not change once before the loop,
+    # the loop is wrapped in lets binding them, nodes are copied rather than changed because
+    # parsed programs are cached and shared
+    if not is_dataclass(subprogram):
+        return subprogram
+    hoisted = {}
+    for f in fields(subprogram):
+        if f.name == "type":
+            continue
+        value = getattr(subprogram, f.name)
+        if isinstance(value, list):
+            new_value = [_hoist_item(e) for e in value]
+            if any(a is not b for a, b in zip(new_value, value)):
+                hoisted[f.name] = new_value
+        elif is_dataclass(value):
+            new_value = hoist_invariants(value)
+            if new_value is not value:
+                hoisted[f.name] = new_value
+    if hoisted:
+        subprogram = copy.copy(subprogram)
+        for name, value in hoisted.items():
+            setattr(subprogram, name, value)
+
+    match subprogram:
+        case while_loop(condition, body):
+            written = written_vars(body)
+            written_in_condition = written_vars(condition)
+            if written is None or written_in_condition is None:
+                return subprogram
+            bindings = []
+            condition = hoist_condition(
+                condition, written | written_in_condition, bindings)
+            result = while_loop(condition, body)
+            for v, e in reversed(bindings):
+                result = let(v, e, result)
+            return result
+    return subprogram
+
+
+def test1():
+    e = binary_operation("*", numeric_literal(10), binary_operation(
+        "+", numeric_literal(2), numeric_literal(3)))
+    assert fold(e) == numeric_literal(50)
+
+    e = binary_operation("<", unary_operation("-", numeric_literal(1)), numeric_literal(0))
+    assert fold(e) == bool_literal(True)
+
+    e = string_concat([string_literal("a"), binary_operation(
+        "+", string_literal("b"), string_literal("c"))])
+    assert fold(e) == string_literal("abc")
+
+
+def test2():
+    # only the constant part of the expression is folded
+    i = identifier.make("i")
+    e = binary_operation("<", get(i), binary_operation(
+        "*", numeric_literal(2), numeric_literal(5)))
+    assert fold(e) == binary_operation("<", get(i), numeric_literal(10))
+
+    # division by zero is still raised at run time
+    e = binary_operation("/", numeric_literal(1), binary_operation(
+        "-", numeric_literal(1), numeric_literal(1)))
+    fe = fold(e)
+    assert fe == binary_operation("/", numeric_literal(1), numeric_literal(0))
+    try:
+        eval_ast(fe)
+        assert False
+    except Exception as ex:
+        assert str(ex) == "Division by zero"
+
+
+def test3():
+    name_space = environment()
+    i = identifier.make("i")
+    j = identifier.make("j")
+    eval_ast(declare(i, numeric_literal(0)), None, name_space)
+    eval_ast(declare(j, numeric_literal(1)), None, name_space)
+    condition = binary_operation("<", get(i), binary_operation(
+        "+", numeric_literal(5), numeric_literal(5)))
+    b1 = set(i, binary_operation("+", get(i), numeric_literal(1)))
+    b2 = set(j, binary_operation("*", get(j), get(i)))
+    e = fold(while_loop(condition, block([b1, b2])))
+    assert e.condition.right == numeric_literal(10)
+    eval_ast(e, None, name_space)
+    assert eval_ast(get(j), None, name_space) == 3628800
+
+
+def test4():
+    x = let_var.make("x")
+    y = let_var.make("y")
+    square = binary_operation("*", x, x)
+    e = let(x, numeric_literal(3), let(y, binary_operation(
+        "+", square, numeric_literal(1)), binary_operation("+", square, y)))
+    assert mark_pure(e) is None
+    assert type(square) is pure_binary_operation and square.free_vars == ("x",)
+    assert type(e.e2) is let
+    assert mark_pure(square) == frozenset(["x"]) and type(square) is pure_binary_operation
+
+    name_space = environment()
+    assert eval_ast(e, None, name_space) == 19
+    assert (id(square), Fraction(3)) in name_space.memo
+
+    # the cached value is only used for the same value of x
+    e = let(x, numeric_literal(4), square)
+    assert eval_ast(e, None, name_space) == 16
+
+    # get reads a variable that set can change, so it is not pure
+    i = identifier.make("i")
+    assert mark_pure(binary_operation("+", get(i), x)) is None
+
+
+def test5():
+    name_space = environment()
+    i = identifier.make("i")
+    n = identifier.make("n")
+    eval_ast(declare(i, numeric_literal(0)), None, name_space)
+    eval_ast(declare(n, numeric_literal(4)), None, name_space)
+    limit = binary_operation("+", binary_operation(
+        "*", get(n), numeric_literal(2)), numeric_literal(1))
+    condition = binary_operation("<", get(i), limit)
+    body = block([set(i, binary_operation("+", get(i), numeric_literal(1)))])
+    e = hoist_invariants(while_loop(condition, body))
+    assert isinstance(e, let) and e.e1 == limit
+    assert e.e2.condition == binary_operation("<", get(i), e.variable)
+    eval_ast(e, None, name_space)
+    assert eval_ast(get(i), None, name_space) == 9
+
+    # the loop is hoisted in a copy of the block, the block itself is left as it was
+    loop = while_loop(condition, body)
+    program = block([loop])
+    e = hoist_invariants(program)
+    assert isinstance(e.exps[0], let) and program.exps[0] is loop
+
+    # n is written by the body, so nothing is hoisted
+    body = block([set(n, binary_operation("+", get(n), numeric_literal(1)))])
+    e = hoist_invariants(while_loop(condition, body))
+    assert isinstance(e, while_loop) and e.condition == condition
+
+    # neither from loops that call functions
+    f = identifier.make("f")
+    body = block([FunctionCall(f, [])])
+    e = hoist_invariants(while_loop(condition, body))
+    assert isinstance(e, while_loop)
+
+
+def test6():
+    # the memo does not mix up a node with a later node that got the same id
+    name_space = environment()
+    x = let_var.make("x")
+    for op, expected in (("-", 4), ("*", 5), ("+", 6), ("-", 4)):
+        operation = binary_operation(op, x, numeric_literal(1))
+        e = let(x, numeric_literal(5), operation)
+        mark_pure(e)
+        assert eval_ast(e, None, name_space) == expected
+        # frees the nodes, the next operation is usually allocated at a freed address
+        del e, operation
+
+
+def test7():
+    # small powers are folded, large ones are left to be computed if the program gets to them
+    e = binary_operation("^", numeric_literal(2), numeric_literal(10))
+    assert fold(e) == numeric_literal(1024)
+    e = binary_operation("^", numeric_literal(10), binary_operation(
+        "^", numeric_literal(10), numeric_literal(10)))
+    assert fold(e) == binary_operation("^", numeric_literal(10), numeric_literal(10 ** 10))
+    e = if_statement(bool_literal(False), block([e]), None)
+    assert fold(e).if_exp.exps[0].right == numeric_literal(10 ** 10)
+
+
+def test8():
+    # short repeated strings are folded, long ones are left to be built if the program gets to them
+    e = binary_operation("*", string_literal("ab"), numeric_literal(3))
+    assert fold(e) == string_literal("ababab")
+    e = binary_operation("*", string_literal("ab"), binary_operation(
+        "^", numeric_literal(10), numeric_literal(12)))
+    assert fold(e) == binary_operation("*", string_literal("ab"), numeric_literal(10 ** 12))
+    e = binary_operation("*", numeric_literal(300000000), string_literal("ab"))
+    assert fold(e) == e
+
+
+# test1()
+# test2()
+# test3()
+# test4()
+# test5()
+# test6()
+# test7()
+# test8()
@@ -3,6 +3,7 @@ from typing import List
 from dataclasses import dataclass
 from fractions import Fraction
 from eval import *
+from eval import _MISSING
 
 
 # resolver
@@ -40,8 +41,15 @@ def resolve(subprogram: AST, lexical_scope=None, name_space=None) -> AST:
                 raise Exception("Variable not defined")
         case let(let_var(name) as v, e1, e2):
             re1 = resolve_(e1)
-            lexical_scope = lexical_scope | {name: v}
-            re2 = resolve_(e2)
+            prev = lexical_scope.get(name, _MISSING)
+            lexical_scope[name] = v
+            try:
+                re2 = resolve_(e2)
+            finally:
+                if prev is _MISSING:
+                    del lexical_scope[name]
+                else:
+                    lexical_scope[name] = prev
             return let(v, re1, re2)
         case declare(identifier(name) as v, e):
             re = resolve_(e)